@@ -35,9 +35,10 @@ from qgis.core import *
 from .resources import *
 # Import the code for the dialog
 from .aChor_dialog import aChorDialog
+from .fieldstats import field_range
+from .tasks import ThresholdTask, ClassifyTask, cached_threshold, min_threshold
 import os.path
-import os, sys, subprocess, shlex, shutil
-from subprocess import Popen, PIPE
+import os, sys, shutil, tempfile
 from osgeo import ogr, osr
 import qgis.utils
 import fiona, logging, csv, time
@@ -92,6 +93,11 @@ class aChor:
         # TODO: We are going to let the user set this up in a future iteration
         self.toolbar = self.iface.addToolBar(u'aChor')
         self.toolbar.setObjectName(u'aChor')
+        # layer of the dialog, running threshold tasks by layer and running
+        # classifications
+        self.layer_path = None
+        self.threshold_tasks = {}
+        self.classify_tasks = []
         self.load_comboBox()
         
     # noinspection PyMethodMayBeStatic
@@ -260,7 +266,6 @@ class aChor:
             self.dlg.label_7.setDisabled(False)
             self.dlg.linefdb.setDisabled(False)
             self.load_comboBox()
-            self.dlg.linefdb.setText(str(round(thresh,4)))
             self.dlg.label_8.setDisabled(True)
             self.dlg.lineps.setDisabled(True)
         if self.dlg.rdb6.isChecked():
@@ -322,14 +327,12 @@ class aChor:
         inDataSource = inDriver.Open(path, 0)
         inLayer = inDataSource.GetLayer()
         global type
-        global thresh
         type = inLayer.GetLayerDefn().GetGeomType()
         if type == 3:  # is a polygon   
-            thresh = pysal.min_threshold_dist_from_shapefile(path)
-            if float(thresh) < 1: #convert decimal degree to meters
-                thresh = round(thresh * 84244.43662,0)
-            else:
-                thresh = round(thresh,0)
+            self.layer_path = str(path).strip()
+            # the distance band is only needed by the hotspot method
+            if self.dlg.rdb4.isChecked():
+                self.request_threshold(self.layer_path)
             self.suggest_sweep(str(path).strip(), self.dlg.comboBox.currentText())
             selectedFieldIndex = self.dlg.comboBox.currentIndex()
             if selectedFieldIndex < 0:
@@ -384,32 +387,43 @@ class aChor:
         else:
             return [layers, False]
         
+    def request_threshold(self, path):
+        """Shows the distance threshold of a layer, it is computed in the
+        background if it is not cached"""
+        thresh = cached_threshold(path)
+        if thresh is not None:
+            self.show_threshold(path, thresh)
+            return
+        self.dlg.linefdb.clear()
+        if path in self.threshold_tasks:
+            return
+        task = ThresholdTask(path)
+        task.computed.connect(self.show_threshold)
+        task.taskCompleted.connect(lambda: self.threshold_tasks.pop(path, None))
+        task.taskTerminated.connect(lambda: self.threshold_tasks.pop(path, None))
+        # keep a reference, the task manager does not
+        self.threshold_tasks[path] = task
+        QgsApplication.taskManager().addTask(task)
+
+    def show_threshold(self, path, thresh):
+        """Fills in the threshold if the layer is still selected"""
+        if path == self.layer_path and self.dlg.rdb4.isChecked():
+            self.dlg.linefdb.setText(str(round(thresh,4)))
+
     def suggest_sweep(self, inp, attr):
         
         global suggestion
         global achor_max_val
         global achor_min_val
         
-        with fiona.open(inp) as source:
-            features = list(source)
-        
+        # only the column is read, the range is cached per layer and field
         try:
-            i = 0
-            for val in features:
-                if not(val['properties'][attr] is None):
-                #achor_max_val = max(val['properties'][attr] for val in features)
-                    value = val['properties'][attr] 
-                    if i == 0:
-                        achor_max_val = value
-                        achor_min_val = value
-                    if value > achor_max_val:
-                        achor_max_val = value
-                    if value < achor_min_val:
-                        achor_min_val = value
-                    i+=1
-
+            low, high = field_range(inp, attr)
         except KeyError:
             return
+        if low is not None:
+            achor_min_val = low
+            achor_max_val = high
         
         if (achor_max_val or achor_min_val):
             valrange = achor_max_val-achor_min_val
@@ -429,7 +443,6 @@ class aChor:
             elif valrange >= 10000:
                 suggestion = int(valrange / 2000)
             
-        source.close()
        
         if suggestion:
                 self.dlg.lineEdit2.setText(str(suggestion))
@@ -748,18 +761,13 @@ class aChor:
                     interval = suggestion
                 
                 #qgis.utils.iface.actionShowPythonDialog().trigger()
-                strdir=self.plugin_dir
-                if os.name == "nt":
-                    py_executable = 'python'
-                    if str(sys.version)[:1] == '3':
-                        py_executable += '3'
-                    strdir=strdir.replace(".","").replace("\\","/").replace("//","/")
-                elif os.name == "posix":
-                    py_executable = 'python'
-                
+                analysisdir = None
                 if method == 4 or method == 6:                                                        
+                    # every run writes its point and hotspot layers to its
+                    # own directory, so classifications can run side by side
+                    analysisdir = tempfile.mkdtemp(prefix="achor_analysis_")
                     #convert polygon to point                    
-                    outpoint = strdir+"/test/inputpoint"
+                    outpoint = os.path.join(analysisdir, "inputpoint")
                     self.getCentroid(shp,outpoint) 
                     
                     u = []
@@ -776,6 +784,9 @@ class aChor:
                         xy = (geometry.GetX(), geometry.GetY())
                         t = t + (xy,)                  
                     if method == 4:                        
+                        if not self.dlg.linefdb.text():
+                            # the background task has not finished yet
+                            self.dlg.linefdb.setText(str(round(min_threshold(str(path).strip()),4)))
                         number = round(float(self.dlg.linefdb.text()),0)        
                         #thresh = pysal.min_threshold_dist_from_shapefile(path)
                         #if float(thresh) < 1: #WGS84
@@ -787,7 +798,7 @@ class aChor:
                         w = DistanceBand(t, int(number), p=2, binary=False)
                         logging.info("Hotspot: Fixed Distance Band: "+self.dlg.linefdb.text())
                         #Run Getis-Ord statistics
-                        outfilename = strdir+"/test/hotspotshp"
+                        outfilename = os.path.join(analysisdir, "hotspotshp")
                         type_w = "B"
                         permutationsValue = 9999                   
                         np.random.seed(12345)                    
@@ -808,7 +819,7 @@ class aChor:
                     # convert attribute csv
                     dbfname=dbf.Table(outpoint+r"/inputpoint.dbf",codepage='utf8')
                     dbfname.open()    
-                    csvname=strdir+"/test/inputpoint/inputpoint.csv"            
+                    csvname=os.path.join(outpoint, "inputpoint.csv")            
                    
                     with open(csvname, 'w', newline = '') as f:                        
                         writer = csv.writer(f)
@@ -851,106 +862,107 @@ class aChor:
                         QMessageBox.warning(self.dlg.show(), self.tr("aChor:Warning"),
                                             self.tr("too few clusters: "+db_labels+"/n Please change eps to get better result"), QMessageBox.Ok)
                     outdbf.close()
-                if not hasattr(sys, 'argv'):
-                    sys.argv  = ['']
-                sys.argv.append(classnum)
-                sys.argv.append(interval)
-                sys.argv.append(field)
-                sys.argv.append(shp)
-                sys.argv.append(method)
-                
-                cmd=py_executable+" "+strdir+"/class_achor.py "+classnum+" "+str(interval)+" "+field+" "+shp.strip().replace('\\',r'/')
-                
-                sys.argv.append(calfd)
-                cmd+= " " + calfd
-                
-                cmd += " -m "+ str(method)
-                
                 logging.info("Starting main script")
-                QMessageBox.warning(self.dlg.show(), self.tr("aChor:Info"),
-                     self.tr("Starting Main Script... Please wait for response"), QMessageBox.Ok)
-                proc = subprocess.Popen(shlex.split(cmd),shell=False,stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-    
-                while True:
-                    out = proc.stdout.readline()
-                    if (str(out).strip() == "b''" or str(out).strip() == '') and proc.poll() is not None:
-                        break
-                    if not (str(out).strip() == '' or str(out).strip() == "b''"):
-                        print('info:'+str(out).strip())
-                    
-                
-                csvfile = strdir+'/achorbreaks.csv'
-                 
-                rcsv = open(csvfile, 'r')
-                sortedlist = sorted(rcsv, key= lambda x: float(x))
-               
-                i = 0
-                
-                ranges = []
-                colorstr = []
-                minval = achor_min_val
-                while i < int(classnum)-1:                  
-                    colorstr.append(str(minval) + '_' + sortedlist[i].strip())                        
-                    minval = round(float(sortedlist[i].strip()),4)
-                    logging.info('breaks:'+sortedlist[i])
-                    i += 1
-                
-                # create colorramps according to the amount of classes/breaks
-                white_blue = self.create_colorrange(int(classnum), '#FFFFFF', '#3182bd') #default
-                white_purple = self.create_colorrange(int(classnum), '#FFFFFF', '#756bb1')
-                white_orange = self.create_colorrange(int(classnum), '#FFFFFF', '#e6550d')
-                yellow_cyan_blue = self.create_colorrange(int(classnum), '#edf8b1', '#2c7fb8', '#7fcdbb')
-                white_blue_green = self.create_colorrange(int(classnum), '#ece2f0', '#1c9099', '#a6bddb')
-                white_pink_purple = self.create_colorrange(int(classnum), '#FFFFFF', 'c51b8a', 'fa9fb5')
+                # classify in a background task, QGIS stays usable and the
+                # task can be canceled, the renderer is applied when it is done
+                task = ClassifyTask("aChor: {} classification of {}".format(display, field),
+                                    shp.strip().replace('\\',r'/'), field, classnum, interval, method, calfd,
+                                    analysisdir=analysisdir)
+                limits = (achor_min_val, achor_max_val)
+                task.classified.connect(lambda brks: self.apply_breaks(task, brks, classnum, field, limits,
+                                                                       myVectorLayer, analysisdir))
+                task.failed.connect(lambda error: self.classification_failed(task, error, analysisdir))
+                task.canceled.connect(lambda: self.classification_canceled(task, analysisdir))
+                # keep a reference, the task manager does not
+                self.classify_tasks.append(task)
+                QgsApplication.taskManager().addTask(task)
+                self.iface.messageBar().pushMessage("aChor", self.tr("Classification started, see the task manager"),
+                                                    Qgis.Info)
+
+    def apply_breaks(self, task, brks, classnum, field, limits, myVectorLayer, analysisdir):
+        """Creates the graduated renderer from the breaks of a classification
+        task and loads the layer"""
+        achor_min_val, achor_max_val = limits
+        sortedlist = [str(brk) for brk in sorted(brks)]
+       
+        i = 0
+        
+        ranges = []
+        colorstr = []
+        minval = achor_min_val
+        while i < int(classnum)-1:                  
+            colorstr.append(str(minval) + '_' + sortedlist[i].strip())                        
+            minval = round(float(sortedlist[i].strip()),4)
+            logging.info('breaks:'+sortedlist[i])
+            i += 1
+        
+        # create colorramps according to the amount of classes/breaks
+        white_blue = self.create_colorrange(int(classnum), '#FFFFFF', '#3182bd') #default
+        white_purple = self.create_colorrange(int(classnum), '#FFFFFF', '#756bb1')
+        white_orange = self.create_colorrange(int(classnum), '#FFFFFF', '#e6550d')
+        yellow_cyan_blue = self.create_colorrange(int(classnum), '#edf8b1', '#2c7fb8', '#7fcdbb')
+        white_blue_green = self.create_colorrange(int(classnum), '#ece2f0', '#1c9099', '#a6bddb')
+        white_pink_purple = self.create_colorrange(int(classnum), '#FFFFFF', 'c51b8a', 'fa9fb5')
     
-                crange_selection = self.dlg.cBox.currentIndex() # get the selection from the gui
-                
-                # provide other options
-                if crange_selection == 0:
-                    crange = white_blue
-                elif crange_selection == 1:
-                    crange = white_purple
-                elif crange_selection == 2:
-                    crange = white_orange                 
-                elif crange_selection == 3:
-                    crange = yellow_cyan_blue
-                elif crange_selection == 4:
-                    crange = white_blue_green
-                elif crange_selection == 5:
-                    crange = white_pink_purple
-                    
-                color_ranges = []
-                for i in range(len(colorstr)-1):
-                    color_ranges.append((colorstr[i], float(colorstr[i].split('_')[0]), float(colorstr[i].split('_')[1]), crange[i]))
-                    if i == len(colorstr)-2:
-                        color_ranges.append((colorstr[i+1], float(colorstr[i+1].split('_')[0]), float(colorstr[i+1].split('_')[1]), crange[i+1]))
-                        color_ranges.append((colorstr[i+1].split("_")[1] + "_" + str(achor_max_val), float(colorstr[i+1].split("_")[1]), float(achor_max_val), crange[i+2]))
+        crange_selection = self.dlg.cBox.currentIndex() # get the selection from the gui
+        
+        # provide other options
+        if crange_selection == 0:
+            crange = white_blue
+        elif crange_selection == 1:
+            crange = white_purple
+        elif crange_selection == 2:
+            crange = white_orange                 
+        elif crange_selection == 3:
+            crange = yellow_cyan_blue
+        elif crange_selection == 4:
+            crange = white_blue_green
+        elif crange_selection == 5:
+            crange = white_pink_purple
+            
+        color_ranges = []
+        for i in range(len(colorstr)-1):
+            color_ranges.append((colorstr[i], float(colorstr[i].split('_')[0]), float(colorstr[i].split('_')[1]), crange[i]))
+            if i == len(colorstr)-2:
+                color_ranges.append((colorstr[i+1], float(colorstr[i+1].split('_')[0]), float(colorstr[i+1].split('_')[1]), crange[i+1]))
+                color_ranges.append((colorstr[i+1].split("_")[1] + "_" + str(achor_max_val), float(colorstr[i+1].split("_")[1]), float(achor_max_val), crange[i+2]))
     
-                # create a category for each item in attribute
-                for label, lower, upper, color in color_ranges:
-                     symbol = QgsSymbol.defaultSymbol(myVectorLayer.geometryType())
-                     symbol.setColor(QColor(color))
-                     rng = QgsRendererRange(lower, upper, symbol, label)
-                     ranges.append(rng)
-                    
-                # create the renderer and assign it to a layer
-                expression = field # field name               
-                renderer = QgsGraduatedSymbolRenderer(expression, ranges)
-                myVectorLayer.setRenderer(renderer)
-
-                # load the layer with class breaks
-                QgsProject.instance().addMapLayer(myVectorLayer)
-                myVectorLayer.triggerRepaint()
-                rcsv.close()
-                # remove temporarily files
-                os.remove(csvfile)
-                if method == 4:
-                    filelist = [ f for f in os.listdir(strdir+"/test/") if f.startswith("hotspotshp") ]
-                    for f in filelist:
-                        os.remove(os.path.join(strdir+"/test/", f))
-                if method == 4 or method == 6:
-                    shutil.rmtree(self.plugin_dir+"/test/inputpoint")
-                shutil.rmtree(self.plugin_dir+"/tmp")
-                print("log: aChor Classification Success")
-                QMessageBox.information(self.dlg.show(), self.tr("aChor:Result"),
-                     self.tr("aChor Classification Result Successful Loaded"), QMessageBox.Ok)
+        # create a category for each item in attribute
+        for label, lower, upper, color in color_ranges:
+             symbol = QgsSymbol.defaultSymbol(myVectorLayer.geometryType())
+             symbol.setColor(QColor(color))
+             rng = QgsRendererRange(lower, upper, symbol, label)
+             ranges.append(rng)
+            
+        # create the renderer and assign it to a layer
+        expression = field # field name               
+        renderer = QgsGraduatedSymbolRenderer(expression, ranges)
+        myVectorLayer.setRenderer(renderer)
+
+        # load the layer with class breaks
+        QgsProject.instance().addMapLayer(myVectorLayer)
+        myVectorLayer.triggerRepaint()
+        # remove temporarily files
+        self.remove_task(task, analysisdir)
+        print("log: aChor Classification Success")
+        QMessageBox.information(self.dlg.show(), self.tr("aChor:Result"),
+             self.tr("aChor Classification Result Successful Loaded"), QMessageBox.Ok)
+
+    def classification_failed(self, task, error, analysisdir):
+        logging.error("aChor classification failed: " + error)
+        self.remove_task(task, analysisdir)
+        QMessageBox.warning(self.dlg.show(), self.tr("aChor:Warning"),
+                            self.tr("aChor classification failed: "+error), QMessageBox.Ok)
+
+    def classification_canceled(self, task, analysisdir):
+        logging.info("aChor classification canceled")
+        self.remove_task(task, analysisdir)
+        self.iface.messageBar().pushMessage("aChor", self.tr("Classification canceled"), Qgis.Warning)
+
+    def remove_task(self, task, analysisdir):
+        """Forgets a finished classification task and removes its analysis
+        directory (hotspot and cluster method)"""
+        if task in self.classify_tasks:
+            self.classify_tasks.remove(task)
+        if analysisdir:
+            shutil.rmtree(analysisdir, ignore_errors=True)
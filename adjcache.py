@@ -0,0 +1,113 @@
+"""Persistent on-disk adjacency cache for aChor
+
+The polygon adjacency of a shapefile does not depend on the field, method,
+class number or sweep interval of a classification. This module stores the
+result of the geometry stage of the neighbour search in a sidecar file next
+to the shapefile (<name>.achor.npz), so a repeated run on the same dataset
+only has to read the attribute table.
+
+The cache is keyed by a fingerprint of the .shp and .dbf files. A matching
+size and modification time is accepted right away, if only the modification
+time differs the content hash decides. Any other change invalidates the
+cache and it is rebuilt on the next run."""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 2
+SUFFIXES = ('.shp', '.dbf')
+
+
+def cache_path(shp):
+    """Returns the path of the sidecar cache file of a shapefile"""
+    return os.path.splitext(shp)[0] + '.achor.npz'
+
+
+def _files(shp):
+    base = os.path.splitext(shp)[0]
+    return [base + suffix for suffix in SUFFIXES]
+
+
+def file_stats(shp):
+    """Returns size and modification time (ns) of the .shp and .dbf file"""
+    stats = []
+    for path in _files(shp):
+        st = os.stat(path)
+        stats.append((st.st_size, st.st_mtime_ns))
+    return np.array(stats, dtype=np.int64)
+
+
+def content_hash(shp, blocksize=1 << 20):
+    """Returns the sha1 hex digest over the content of the .shp and .dbf file"""
+    digest = hashlib.sha1()
+    for path in _files(shp):
+        with open(path, 'rb') as f:
+            block = f.read(blocksize)
+            while block:
+                digest.update(block)
+                block = f.read(blocksize)
+    return digest.hexdigest()
+
+
+def load(shp):
+    """Loads the cached adjacency of a shapefile
+
+    Returns:
+        A dict with the cached arrays or None, if there is no cache or the
+        dataset has changed since it was written"""
+
+    path = cache_path(shp)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            cached = dict((key, npz[key]) for key in npz.files)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if int(cached.get('version', -1)) != CACHE_VERSION:
+        return None
+
+    try:
+        stats = file_stats(shp)
+    except OSError:
+        return None
+    if np.array_equal(stats, cached['stats']):
+        return cached
+    # touched but maybe not changed, let the content decide
+    if np.array_equal(stats[:, 0], cached['stats'][:, 0]) \
+            and content_hash(shp) == str(cached['hash']):
+        cached['stats'] = stats
+        _write(path, cached)
+        return cached
+    return None
+
+
+def save(shp, **arrays):
+    """Writes the adjacency arrays of a shapefile to its sidecar cache
+
+    Failing to write the cache (e.g. a read-only directory) is not an error,
+    the classification just runs without cache next time again."""
+
+    arrays['version'] = np.array(CACHE_VERSION)
+    arrays['stats'] = file_stats(shp)
+    arrays['hash'] = np.array(content_hash(shp))
+    try:
+        _write(cache_path(shp), arrays)
+    except (IOError, OSError) as e:
+        print("Could not write adjacency cache: {}".format(e))
+
+
+def _write(path, arrays):
+    # unique temporary name, concurrent runs on the same dataset must not
+    # write into each others file
+    fd, tmp = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
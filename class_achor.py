@@ -1,13 +1,152 @@
 import fiona
-import rtree
-import sys, os, subprocess, csv, time
+import sys, os, csv, time, signal, threading
 import sqlite3 as sql
 import array
 import argparse
-from shapely.geometry import shape, LineString, Point		   
-from rtree import index
+import numpy as np
 from decimal import *
 import shutil
+import tempfile
+try:
+    # imported from the QGIS plugin package
+    from .contiguity import build_contiguity, centroid_distances, ENGINES
+    from .ingest import explode
+    from .columnar import PairStore, center_stats, candidate_limit
+    from . import adjcache
+    from .streaming import stream_topology
+    from .weights import load_weights, read_table
+    from .sweep import exact_sweep, discrete_sweep, DiscreteSweep
+except ImportError:
+    # run as script from the plugin directory
+    from contiguity import build_contiguity, centroid_distances, ENGINES
+    from ingest import explode
+    from columnar import PairStore, center_stats, candidate_limit
+    import adjcache
+    from streaming import stream_topology
+    from weights import load_weights, read_table
+    from sweep import exact_sweep, discrete_sweep, DiscreteSweep
+
+SWEEP_MODES = ('interval', 'exact')
+BACKENDS = ('sqlite', 'numpy')
+# neighbor pairs and their per center summary, written by the neighborsearch
+PAIR_COLUMNS = ("CenterID", "PolygonID", "Center", "Neighbor", "Difference", "Distance", "CID", "PID")
+STATS_COLUMNS = ("CenterID", "Degree", "MinDiff", "MaxDiff", "MinAbs", "MaxAbs", "LocalMax", "LocalMin")
+# phases of a classification and the percentage at which they start
+PHASES = (('ingest', 0), ('neighbors', 15), ('selection', 50), ('breaks', 60), ('done', 100))
+
+
+class BulkWriter(object):
+    """Buffers rows for one table and loads them with executemany
+    
+    Rows are collected in memory and flushed in chunks, each chunk is written
+    inside a single transaction instead of committing every row on its own.
+    
+    Args:
+        con: sqlite3 connection
+        table (str): name of the target table
+        columns (tuple): column names of the rows
+        chunksize (int): number of buffered rows which triggers a flush"""
+    
+    def __init__(self, con, table, columns, chunksize=50000):
+        self.con = con
+        self.chunksize = int(chunksize)
+        self.rows = []
+        self.sql_insert = """INSERT INTO {} ({}) VALUES ({});""".format(
+            table, ", ".join(columns), ", ".join("?" * len(columns)))
+    
+    def add(self, row):
+        """Buffers a single row and flushes if the chunk is full"""
+        self.rows.append(row)
+        if len(self.rows) >= self.chunksize:
+            self.flush()
+    
+    def flush(self):
+        """Writes all buffered rows in one transaction"""
+        if self.rows:
+            with self.con:
+                self.con.executemany(self.sql_insert, self.rows)
+            self.rows = []
+    
+    def write_columns(self, columns):
+        """Writes whole columns (lists or arrays) as rows in one transaction"""
+        self.flush()
+        columns = [column.tolist() if hasattr(column, 'tolist') else column for column in columns]
+        with self.con:
+            self.con.executemany(self.sql_insert, zip(*columns))
+
+
+def load_topology(inputshp, cache=True, contiguity='strtree', snap=None, workers=None, chunksize=None,
+                  workdir=None, progress=None):
+    """Returns the single part features and their adjacency
+    
+    On a cold run the input is exploded to single parts in-process and the 
+    adjacency is computed from the geometries. The result is stored in the 
+    adjacency cache of the shapefile, a warm run only reads the attribute 
+    table and takes the adjacency from there.
+    
+    Args:
+        inputshp (str): path to the input shapefile
+        cache (bool): read and write the adjacency cache
+        contiguity (str): contiguity engine, see contiguity.build_contiguity
+        snap (float): snapping grid of the topology engines (optional)
+        workers (int): processes of the tiled parallel neighbor search
+            (optional, default: serial)
+        chunksize (int): parts per chunk of the out-of-core neighbor search,
+            which holds only the geometries of one chunk in memory (optional,
+            the predicate engine is used)
+        workdir (str): directory for its temporary files (optional)
+        progress: called with the phase name 'neighbors' when the features
+            are read and the pairs are searched or taken from the cache
+            (optional)
+    
+    Returns:
+        A tuple (features, center, neighbor, distance), where features
+        is a list of single part feature dicts (at least 'properties')
+        and center, neighbor and distance are the edge list arrays"""
+    
+    fid='PARTID'
+    # a cache built with another contiguity rule is not used
+    engine = contiguity if not snap else "{}:{!r}".format(contiguity, float(snap))
+    if cache:
+        cached = adjcache.load(inputshp)
+        if cached is not None and str(cached.get('engine', 'strtree')) == engine:
+            print("Using adjacency cache: " + adjcache.cache_path(inputshp))
+            if progress is not None:
+                progress('neighbors')
+            with fiona.open(inputshp, ignore_geometry=True) as source:
+                records = dict((int(feature['id']), feature['properties']) for feature in source)
+            features = []
+            for uid, srcfid in enumerate(cached['fids'].tolist()):
+                properties = dict(records[srcfid])
+                properties[fid] = uid
+                properties['SRCFID'] = srcfid
+                features.append({'properties': properties})
+            return features, cached['center'], cached['neighbor'], cached['distance']
+    
+    # stream and explode the features, every geometry is parsed once, then
+    # find all adjacent pairs with one bulk predicate query (or from the
+    # shared vertices/edges), the edge list is sorted by center index
+    if chunksize:
+        print("Out-of-core neighbor search, {} parts per chunk".format(chunksize))
+        if progress is not None:
+            progress('neighbors')
+        features, center_idx, neighbor_idx, distances = stream_topology(inputshp, chunksize, workdir,
+                                                                        contiguity == 'rook')
+    else:
+        features, geometries = explode(inputshp)
+        if progress is not None:
+            progress('neighbors')
+        center_idx, neighbor_idx = build_contiguity(geometries, contiguity, snap, workers)
+        distances = centroid_distances(geometries, center_idx, neighbor_idx)
+    
+    if cache:
+        adjcache.save(inputshp,
+                      center=center_idx,
+                      neighbor=neighbor_idx,
+                      distance=distances,
+                      engine=np.array(engine),
+                      fids=np.array([feature['properties']['SRCFID'] for feature in features], dtype=np.int64))
+    return features, center_idx, neighbor_idx, distances
 
 
 class aChor(object):
@@ -16,82 +155,168 @@ class aChor(object):
     
     def version_check(method):
         """A wrapper for checking the current python environment version for
-        selecting the appropriate arguments for open()"""
+        selecting the appropriate arguments for open()
+        
+        If no csv file is set, the method gets None instead of a file object"""
         def wrapper(self):
+            if not self.csvfile:
+                return method(self, None)
             if sys.version_info.major < 3:
-                with open("achorbreaks.csv", 'wb') as fout:
-                    method(self, fout)
+                with open(self.csvfile, 'wb') as fout:
+                    return method(self, fout)
             else:
-                with open("achorbreaks.csv", 'w', newline='') as fout:
-                    method(self, fout)
-            return None
+                with open(self.csvfile, 'w', newline='') as fout:
+                    return method(self, fout)
         return wrapper
     
-    def __init__(self, cls, swp, field, shp, calfd='', method=1, memory=None):
+    def __init__(self, cls, swp, field, shp, calfd='', method=1, memory=None, cache=True,
+                 sweep_mode='interval', csvfile="achorbreaks.csv", workdir=None, topology=None,
+                 backend='sqlite', threshold=None, sweeps=None, limit=None, weights=None, idfield=None,
+                 contiguity='strtree', snap=None, workers=None, chunksize=None, progress=None,
+                 analysisdir=None):
         
         self.cls = int(cls)
         self.brk_num = int(cls)-1
         self.swp = float(swp)
+        # selection threshold on the differences, by default the sweep interval
+        self.threshold = self.swp if threshold is None else float(threshold)
+        self.sweeps = None
+        if sweeps is not None:
+            self.sweeps = [(float(interval), float(interval) if value is None else float(value))
+                           for interval, value in sweeps]
+            if not self.sweeps:
+                raise ValueError("No sweep intervals given")
+            self.swp, self.threshold = self.sweeps[0]
         self.field = str(field)
         self.shp = str(shp)
         self.calfd = str(calfd)
         self.method = int(method)
         self.memory = memory
+        self.cache = bool(cache)
+        self.sweep_mode = str(sweep_mode)
+        self.discrete_sweep = None
+        self.csvfile = csvfile
+        self.shared_topology = topology
+        self.backend = str(backend)
+        self.store = None
+        # number of selected candidates: None for the defaults of the
+        # methods (3000, 1500 for localmax and localmin), 0 for no limit
+        candidate_limit(limit, 0)
+        self.limit = limit
+        self.brks = []
+        self.results = []
+        if self.sweep_mode not in SWEEP_MODES:
+            raise ValueError("Unknown sweep mode: {}".format(sweep_mode))
+        if self.backend not in BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
+        if contiguity not in ENGINES:
+            raise ValueError("Unknown contiguity engine: {}".format(contiguity))
+        self.contiguity = contiguity
+        self.snap = snap
+        self.workers = workers
+        self.chunksize = chunksize
+        # progress(percent, phase) is called at every phase and break, an
+        # exception raised by it aborts the classification
+        self.progress = progress
+        # output of the hotspot or cluster analysis of the plugin:
+        # hotspotshp.dbf (method 4) or inputpoint/inputpoint.dbf (method 6)
+        self.analysisdir = analysisdir
+        if self.method in (4, 6) and not analysisdir:
+            raise ValueError("Method {} needs the directory of the hotspot or cluster analysis".format(method))
+        if weights:
+            # shp is the attribute table of the weights, there is no geometry
+            if self.method in (4, 6):
+                raise ValueError("Method {} needs the shapefile and can not be run on weights".format(method))
+            if self.shared_topology is None:
+                self.shared_topology = load_weights(weights, self.shp, idfield)
 
             
+        # every instance works in its own temporary directory (updated
+        # polygons, database on disk) so several classifications can run
+        # side by side in one process
+        self.workspace = tempfile.mkdtemp(prefix="achor_", dir=workdir)
         if not memory:
             self.memory = ":memory:"
         else:
-            self.memory = "achor.db"
+            self.memory = os.path.join(self.workspace, "achor.db")
         
-        global con
-        global cur
-        
-        con = sql.connect(self.memory)
-        #dir_path = os.path.split(os.path.abspath(scriptname))[0]
-        #con = sql.connect( dir_path + r"/achor.db")
-        cur = con.cursor()
-        cur.execute("PRAGMA synchronous = OFF")
-        cur.execute("PRAGMA journal_mode = MEMORY")
+        # the numpy backend keeps the working tables in a PairStore, which is
+        # created by the neighborsearch
+        self.con = None
+        self.cur = None
+        if self.backend == 'sqlite':
+            self.con = sql.connect(self.memory)
+            self.cur = self.con.cursor()
+            self.cur.execute("PRAGMA synchronous = OFF")
+            self.cur.execute("PRAGMA journal_mode = MEMORY")
 
-        self.db()
-        if self.method == 4:
-            self.upd_attribute()
-        elif self.method == 6:
-            self.upd_attribute()
-        self.neighborsearch()
-        if not (self.method == 71 or self.method == 72):
-            self.selection()
-        self.generate_output()    
-    
-    def upd_attribute(self):         
-        dir_path = str(os.path.split(os.path.abspath(scriptname))[0]).strip()
+        try:
+            self.report('ingest')
+            if self.con is not None:
+                self.db()
+            self.neighborsearch()
+            if self.sweeps is not None:
+                self.results = self.parameter_sweep(self.sweeps)
+            else:
+                if not (self.method == 71 or self.method == 72):
+                    self.selection()
+                self.brks = self.generate_output()
+            self.report('done')
+        finally:
+            self.close()
+    
+    def close(self):
+        """Closes the database connection and removes the workspace"""
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+            self.cur = None
+        shutil.rmtree(self.workspace, ignore_errors=True)
+    
+    def report(self, phase, done=0.0):
+        """Passes the progress to the progress callback, if there is one
+        
+        Args:
+            phase (str): name of the phase, see PHASES
+            done (float): part of the phase which is done (0 to 1)"""
+        if self.progress is None:
+            return
+        names = [name for name, start in PHASES]
+        i = names.index(phase)
+        start = PHASES[i][1]
+        end = PHASES[i+1][1] if i+1 < len(PHASES) else start
+        self.progress(start + done * (end - start), phase)
+    
+    def analysis_table(self):
+        """Returns the table with the attributes of the hotspot (method 4) or
+        cluster (method 6) analysis, one row per feature of the input"""
         if self.method == 4:
-            attr_p = dir_path + r"/test/hotspotshp.dbf"
-        elif self.method ==6:
-            attr_p = dir_path + r"/test/inputpoint/inputpoint.dbf"            
-        outshp = dir_path + r"/test/inputpoint/polygon.shp"        
-        with fiona.open(self.shp) as src:
-            meta = src.meta            
-            with fiona.open (outshp, 'w', **meta) as output: 
-                #iterate through polygons
-                for polygon in src:            
-                    output.write(polygon)
-        print(outshp[:-4]+".dbf")
-        if os.path.exists(outshp[:-4]+".dbf"):
-            #os.remove(outshp[:-4]+".dbf")
-            shutil.copy(attr_p,outshp[:-4]+".dbf")
-            print("finish update field")            
-        output.close()
-        src.close()
+            return os.path.join(self.analysisdir, "hotspotshp.dbf")
+        return os.path.join(self.analysisdir, "inputpoint", "inputpoint.dbf")
 
+    def analysis_features(self, features):
+        """Returns the features with the attributes of the analysis table
         
+        The geometry of the input is unchanged, so its topology (and the
+        adjacency cache) is used as it is and only the attributes of every
+        part are taken from the row of its source feature."""
+        records = read_table(self.analysis_table())
+        updated = []
+        for feature in features:
+            properties = dict(records[feature['properties']['SRCFID']])
+            properties['PARTID'] = feature['properties']['PARTID']
+            properties['SRCFID'] = feature['properties']['SRCFID']
+            updated.append({'properties': properties})
+        return updated
+
     def global_break(self):
         """Calculate break value between global extreme value (minimum or maximum) and it's nearest (geometric) neighbour.
             
             Returns:
                 break_values (dict): Dictionary with break values e.g. '{"Min": 0.1, "Max": 10.3}'
         """
+        if self.store is not None:
+            return self.store.global_break()
         break_values = {}
         # SQL query to get the break between global minimum and nearest neighbor
         sql_global_min_break = """SELECT ((Center + Neighbor) / 2) AS break 
@@ -99,8 +324,8 @@ class aChor(object):
                                         WHERE CenterID != PolygonID 
                                         ORDER BY Center ASC, ABS(Difference) ASC 
                                         LIMIT 1;"""
-        cur.execute(sql_global_min_break)
-        break_values["Min"] = cur.fetchone()[0] # Return only first value of tuple
+        self.cur.execute(sql_global_min_break)
+        break_values["Min"] = self.cur.fetchone()[0] # Return only first value of tuple
 
         # SQL query to get the break between global maxmimum and nearest neighbor
         sql_global_max_break = """SELECT ((Center + Neighbor) / 2) AS break 
@@ -108,8 +333,8 @@ class aChor(object):
                                         WHERE CenterID != PolygonID 
                                         ORDER BY Center DESC, ABS(Difference) ASC 
                                         LIMIT 1;"""
-        cur.execute(sql_global_max_break)
-        break_values["Max"] = cur.fetchone()[0] # Return only first value of tuple
+        self.cur.execute(sql_global_max_break)
+        break_values["Max"] = self.cur.fetchone()[0] # Return only first value of tuple
 
         return break_values
     
@@ -130,12 +355,15 @@ class aChor(object):
         values.sort()
         n = len(values)
         breaks = []
+        if n == 0:
+            return breaks
         for i in range(classes):
             q = i / float(classes)
             a = q * n
             aa = int(q * n)
             r = a - aa
-            Xq = (1 - r) * values[aa] + r * values[aa+1]
+            # few distinct values (ties): the last quantiles are the maximum
+            Xq = (1 - r) * values[aa] + r * values[min(aa+1, n-1)]
             breaks.append(Xq)
         breaks.append(values[n-1])
         return breaks
@@ -147,11 +375,13 @@ class aChor(object):
             Returns:
                 values (list)
         """
+        if self.store is not None:
+            return self.store.inbetween_values()
         values = []
         sql_query = """SELECT DISTINCT Center 
                         FROM neighborPairs;"""
-        cur.execute(sql_query)
-        results = cur.fetchall()
+        self.cur.execute(sql_query)
+        results = self.cur.fetchall()
         values = [result[0] for result in results]
         del values[0]
         del values[-1]
@@ -189,9 +419,12 @@ class aChor(object):
         
         Args:
             fout - file object from the version_check decorator pointing to the
-                   output file"""
+                   output file or None, if no csv file is written
         
-        writer = csv.writer(fout, delimiter=",")
+        Returns:
+            brks (list): the generated breaks"""
+        
+        writer = csv.writer(fout, delimiter=",") if fout else None
         brks = []
         # create custom counters with distinct initial values for display
         brk_counter = 1 # we start with initally 1 break
@@ -224,6 +457,9 @@ class aChor(object):
                         print("Break: {}, Breakvalue: {}".format(brk_counter, brk))
                         cls_counter += 1
                         brk_counter += 1                        
+                if len(brks) < self.brk_num:
+                    # no values between the global breaks
+                    brks = self.desired_breaks(brks, self.brk_num)
             # Global Max/Min with equidistant classification inbetween
             else:
                 # Classifiy breaks between global breaks with equistant method
@@ -235,9 +471,12 @@ class aChor(object):
                     brk_counter += 1
 
             print("{} breaks/{} classes generated.".format(self.brk_num, self.cls)) 
-            [writer.writerow([brk]) for brk in brks] # Write to csv
+            if writer:
+                [writer.writerow([brk]) for brk in brks] # Write to csv
         else:
             for i in range(0, self.brk_num):     
+                if self.sweeps is None:
+                    self.report('breaks', float(i) / self.brk_num)
                 if (self.method <= 3 or self.method ==73) and i == 0:
                     #prioritise return global extremes
                     global_brks = self.global_break()
@@ -258,6 +497,12 @@ class aChor(object):
                             
                 if brk_counter <= self.brk_num:
                     brk_val, no_segment_left = self.breaks()
+                    if brk_val is None:
+                        # nothing to sweep, e.g. no local extremes on a
+                        # field with many tied values
+                        print("No segments left in database")
+                        brks = self.desired_breaks(brks, self.brk_num)
+                        break
                     print("Break: {}, Breakvalue: {}".format(brk_counter, brk_val))
                     if no_segment_left == True and not brk_counter == self.brk_num:
                         print("No segments left in database")
@@ -268,7 +513,9 @@ class aChor(object):
                     cls_counter += 1
                     brk_counter += 1
             print("{} breaks/{} classes generated.".format(self.brk_num, self.cls))                     
-            [writer.writerow([brk]) for brk in brks]     
+            if writer:
+                [writer.writerow([brk]) for brk in brks]     
+        return brks
 
     def desired_breaks(self, brks, brk_num):
         """Creates breaks up to the desired class amount
@@ -284,6 +531,19 @@ class aChor(object):
             - cls: amount of desired classes
         """
         
+        if len(brks) >= brk_num:
+            return brks
+        if len(set(brks)) < 2:
+            # there is no interval to split yet, start from the global breaks
+            global_brks = self.global_break()
+            for key in ("Max", "Min"):
+                global_brk = round(global_brks[key], 4)
+                if global_brk not in brks and len(brks) < brk_num:
+                    brks.append(global_brk)
+                    print("Break: {}, Breakvalue: {}".format(len(brks), global_brk)+",  Global"+key.lower())
+            if len(brks) >= brk_num or len(set(brks)) < 2:
+                # constant field, every break is the same
+                return brks + brks[-1:] * (brk_num - len(brks))
         temp_brks = sorted(brks, reverse=True)
         brks_diff = sorted(((i-j, i, j) for i, j in zip(temp_brks, temp_brks[1:])), reverse=True)
         i = 0
@@ -302,387 +562,354 @@ class aChor(object):
                 
         return self.desired_breaks(brks, brk_num)
         
+    def parameter_sweep(self, sweeps):
+        """Generates the breaks for several sweep intervals and thresholds
+        
+        The neighbor search is done once for all of them. The selection only
+        depends on the threshold and is redone when it changes, for every
+        sweep interval only the line sweep runs again.
+        
+        Args:
+            sweeps (list): (interval, threshold) tuples
+        
+        Returns:
+            results (list): (interval, threshold, brks) tuples in the order
+            of sweeps"""
+        
+        thresholds = []
+        for interval, threshold in sweeps:
+            if threshold not in thresholds:
+                thresholds.append(threshold)
+        results = [None] * len(sweeps)
+        done = 0
+        for n, threshold in enumerate(thresholds):
+            if n > 0:
+                self.reset_selection()
+                self.threshold = threshold
+                self.neighbor_extremes()
+            if not (self.method == 71 or self.method == 72):
+                self.selection()
+            for i, (interval, value) in enumerate(sweeps):
+                if value != threshold:
+                    continue
+                self.report('breaks', float(done) / len(sweeps))
+                done += 1
+                print("Sweep interval: {}, threshold: {}".format(interval, threshold))
+                self.swp = interval
+                self.reset_line_sweep()
+                results[i] = (interval, threshold, self.generate_output())
+        return results
+    
+    def reset_line_sweep(self):
+        """Restores all segments of the selection for a new line sweep"""
+        if self.store is not None:
+            self.store.clear_line_sweep()
+        else:
+            self.cur.execute("DELETE FROM line_sweep")
+            self.con.commit()
+        self.discrete_sweep = None
+    
+    def reset_selection(self):
+        """Drops the results of the selection and of every other step that
+        depends on the threshold"""
+        if self.store is not None:
+            self.store.clear_selection(self.method)
+        else:
+            for table in ("locExtremePairs", "locmaxPairs", "locminPairs", "hotspotPairs", "line_sweep"):
+                self.cur.execute("DELETE FROM {}".format(table))
+            if self.method in (5, 6, 8, 73):
+                self.cur.execute("DELETE FROM locExtreme")
+            self.con.commit()
+        self.discrete_sweep = None
+
     def db(self):
-        """Creates necessary tables in the database"""
+        """Creates necessary tables in the database
+        
+        Ids are INTEGER and values REAL. Tables which are only accessed by 
+        their primary key are WITHOUT ROWID, neighborPairs is clustered by 
+        ("CenterID", "PolygonID") so every per-center lookup of the selection 
+        is a range scan of the table itself. line_sweep keeps its rowid, 
+        which identifies the segments of the sweep."""
         
         # neighborsearch
         sql_locextreme = """
         CREATE TABLE IF NOT EXISTS locExtreme(
-            "PolygonID" "text" NOT NULL,
-            "Note" "text",
+            "PolygonID" integer NOT NULL,
+            "Note" text,
           CONSTRAINT "locExt_pkey" PRIMARY KEY ("PolygonID") 
-        )
+        ) WITHOUT ROWID;
         """        
-        cur.execute(sql_locextreme)
-        sql_locextreme = """
-        CREATE INDEX index_locExt ON locExtreme ("PolygonID");
-        """ 
-        cur.execute(sql_locextreme)
+        self.cur.execute(sql_locextreme)
         
         sql_neighborpairs = """
         CREATE TABLE IF NOT EXISTS "neighborPairs" (
-            "CenterID" text NOT NULL,
-            "PolygonID" text NOT NULL,
-            "Center" numeric NOT NULL,
-            "Neighbor" numeric NOT NULL,
-            "Difference" numeric NOT NULL,
-            "Distance" numeric NOT NULL,
+            "CenterID" integer NOT NULL,
+            "PolygonID" integer NOT NULL,
+            "Center" real NOT NULL,
+            "Neighbor" real NOT NULL,
+            "Difference" real NOT NULL,
+            "Distance" real NOT NULL,
             "CID" numeric,
             "PID" numeric,
           CONSTRAINT "neighborPairs_pkey" PRIMARY KEY ("CenterID", "PolygonID")
-        );     
+        ) WITHOUT ROWID;
         """
-        cur.execute(sql_neighborpairs)
-        sql_neighborpairs = """
-        CREATE INDEX index_nbPairs ON neighborPairs ("CenterID", "PolygonID");
+        self.cur.execute(sql_neighborpairs)
+        
+        # per center summary of neighborPairs: the selection only has to look
+        # at the pairs of a center, if some but not all of them pass the
+        # sweep interval
+        sql_centerstats = """
+        CREATE TABLE IF NOT EXISTS "centerStats" (
+            "CenterID" integer NOT NULL,
+            "Degree" integer NOT NULL,
+            "MinDiff" real NOT NULL,
+            "MaxDiff" real NOT NULL,
+            "MinAbs" real NOT NULL,
+            "MaxAbs" real NOT NULL,
+            "LocalMax" integer NOT NULL,
+            "LocalMin" integer NOT NULL,
+          CONSTRAINT "centerStats_pkey" PRIMARY KEY ("CenterID")
+        ) WITHOUT ROWID;
         """
-        cur.execute(sql_neighborpairs)
+        self.cur.execute(sql_centerstats)
         
-        # selection of localextreme-, localmax- and localminpairs
+        # selection of localextreme-, localmax- and localminpairs, these are
+        # small and always the outer loop of the joins with neighborPairs, 
+        # so they need no index of their own
         sql_localextremepairs = """
         CREATE TABLE IF NOT EXISTS "locExtremePairs" (
-            "CenterID" text NOT NULL,
-             min numeric,
+            "CenterID" integer NOT NULL,
+             min real,
              "Note" text NOT NULL
         );
         """
-        cur.execute(sql_localextremepairs)
-        # index key
-        sql_localextremepairs = """
-        CREATE INDEX index_locExtP ON locExtremePairs ("CenterID");
-        """        
-        cur.execute(sql_localextremepairs)
+        self.cur.execute(sql_localextremepairs)
         
         sql_localmaxpairs = """
         CREATE TABLE IF NOT EXISTS "locmaxPairs" (
-            "CenterID" text NOT NULL,
-            min numeric,
+            "CenterID" integer NOT NULL,
+            min real,
             "Note" text NOT NULL,
         CONSTRAINT "locmaxPairs_pkey" PRIMARY KEY ("CenterID")
-        );
+        ) WITHOUT ROWID;
         """
-        cur.execute(sql_localmaxpairs)
-        
-        sql_localmaxpairs = """
-        CREATE INDEX index_locMaxP ON locmaxPairs ("CenterID");
-        """
-        cur.execute(sql_localmaxpairs)
+        self.cur.execute(sql_localmaxpairs)
         
         sql_localminpairs = """
         CREATE TABLE IF NOT EXISTS "locminPairs" (
-            "CenterID" text NOT NULL,
-            min numeric,
+            "CenterID" integer NOT NULL,
+            min real,
             "Note" text NOT NULL,
         CONSTRAINT "locminPairs_pkey" PRIMARY KEY ("CenterID")
-        );
+        ) WITHOUT ROWID;
         """
-        cur.execute(sql_localminpairs)
-        sql_localminpairs = """
-        CREATE INDEX index_locMinP ON locminPairs ("CenterID");
-        """
-        cur.execute(sql_localminpairs)
+        self.cur.execute(sql_localminpairs)
         
         sql_hotspotpairs = """
         CREATE TABLE IF NOT EXISTS "hotspotPairs" (
-            "CenterID" text NOT NULL,
-            min numeric,
+            "CenterID" integer NOT NULL,
+            min real,
             "Note" text NOT NULL
         );
         """
-        cur.execute(sql_hotspotpairs)
-        sql_hotspotpairs = """
-        CREATE INDEX index_locHotP ON hotspotPairs ("CenterID");
-        """
+        self.cur.execute(sql_hotspotpairs)
         
         # intersection search and break generation
         sql_linesweep = """
         CREATE TABLE IF NOT EXISTS line_sweep (
-           CenterID TEXT NOT NULL, 
-           PolygonID TEXT NOT NULL,
-           Center NUMERIC NOT NULL,
-           Neighbor NUMERIC NOT NULL,
-           min NUMERIC NOT NULL,
+           CenterID INTEGER NOT NULL, 
+           PolygonID INTEGER NOT NULL,
+           Center REAL NOT NULL,
+           Neighbor REAL NOT NULL,
+           min REAL NOT NULL,
            Note TEXT
         );
         """
-        cur.execute(sql_linesweep)
+        self.cur.execute(sql_linesweep)
+        # covers the residual breaks, which pick the segments with the 
+        # highest min (ties in insertion order)
         sql_linesweep = """
-        CREATE INDEX index_linesweep ON line_sweep ("CenterID", "PolygonID");
+        CREATE INDEX index_linesweep ON line_sweep (min);
         """
-        cur.execute(sql_linesweep)
+        self.cur.execute(sql_linesweep)
+        self.con.commit()
+    
+    def sql_limit(self, default):
+        """Returns the LIMIT of a selection query, -1 is no limit in SQLite
         
-        sql_intersection = """
-        CREATE TABLE IF NOT EXISTS intersection (
-            cnt NUMERIC NOT NULL,
-            sweep NUMERIC,
-            seg BLOB
-        );
-        """
-        cur.execute(sql_intersection)
-        sql_intersection = """
-        CREATE INDEX index_intersect ON intersection ("sweep");
-        """
-        cur.execute(sql_intersection)
-        con.commit()
+        SQLite keeps only the first rows of a limited ORDER BY in its sorter
+        instead of sorting all candidates."""
+        limit = candidate_limit(self.limit, default)
+        return -1 if limit is None else limit
+    
+    def analyze(self):
+        """Collects the table statistics after a bulk load
         
-        sql_desired_classes = """
-        CREATE TABLE IF NOT EXISTS desired_classes (
-            brks NUMERIC NOT NULL
-        );
-        """
-        cur.execute(sql_desired_classes)
+        neighborPairs is clustered by its primary key, which already covers 
+        the per-center lookups of the selection, so no secondary index is 
+        built. Without statistics the query planner takes the tables for 
+        equally large and scans all pairs instead of the few selected 
+        centers, a sampled ANALYZE is enough to turn the joins around."""
+        
+        self.cur.execute("PRAGMA analysis_limit = 400")
+        self.cur.execute("ANALYZE")
+        self.con.commit()
+        
+    def topology(self, inputshp):
+        """Returns the single part features and their adjacency, see
+        load_topology. A topology passed to the constructor is used for the
+        input shapefile instead of loading it again."""
+        if self.shared_topology is not None and inputshp == self.shp:
+            return self.shared_topology
+        return load_topology(inputshp, self.cache, self.contiguity, self.snap, self.workers, self.chunksize,
+                             self.workspace, self.report)
         
     def neighborsearch(self):
         
         print("Starting neighbor search...")
         
-        if not os.path.dirname(scriptname):
-            plugin_dir_qgis = os.getcwd()
+        features, center_idx, neighbor_idx, distances = self.topology(self.shp)
+        if self.method == 4 or self.method == 6:
+            features = self.analysis_features(features)
+
+        fid='PARTID'
+        val = self.field
+        cluster = 'dbscan'
+        ids = np.array([feature['properties'][fid] for feature in features], dtype=np.int64)
+        raw = [feature['properties'][val] for feature in features]
+        valid = np.array([value is not None for value in raw], dtype=bool)
+        values = np.array([round(value, 4) if value is not None else np.nan for value in raw], dtype=np.float64)
+        if self.method == 6:
+            # Cluster method
+            category = [feature['properties'][cluster] for feature in features]
+        elif self.method == 8:
+            # Nested method
+            category = [feature['properties'][self.calfd] for feature in features]
         else:
-            plugin_dir_qgis = os.path.split(os.path.abspath(scriptname))[0]
+            category = [''] * len(features)
+        category, labels = np.empty(len(features), dtype=object), category
+        category[:] = labels
         
-        os.chdir(plugin_dir_qgis)
+        # pairs of the edge list (sorted by center) where both values are set
+        edges = np.flatnonzero(valid[center_idx] & valid[neighbor_idx])
+        center = center_idx[edges]
+        neighbor = neighbor_idx[edges]
+        difference = np.round(values[center] - values[neighbor], 4)
+        distance = np.round(np.asarray(distances, dtype=np.float64)[edges], 3)
+        pairs = (ids[center], ids[neighbor], values[center], values[neighbor], difference, distance,
+                 category[center], category[neighbor])
         
-        if not os.path.isdir('tmp'): os.mkdir('tmp') 
-        if self.method == 4 or self.method == 6:
-            inputshp = r"test/inputpoint/polygon.shp"
+        # local extremes are higher (lower) than all of their neighbors
+        stats = center_stats(ids[center], difference)
+        localmax, localmin = stats[6], stats[7]
+        if (self.method <= 3):
+            found = localmax | localmin
+            extremes = (stats[0][found], np.where(localmax[found], "localmax", "localmin").astype(object))
+        elif (self.method == 4):
+            # Hotspot method
+            g_bin = np.array([int(feature['properties']['Gi_Bin']) if ok else 0
+                              for feature, ok in zip(features, valid)], dtype=np.int64)
+            found = (g_bin == 3) | (g_bin == -3)
+            extremes = (ids[found], np.where(g_bin[found] == 3, "hotspot", "coldspot").astype(object))
         else:
-            inputshp = self.shp
-        outputshp = r"tmp/inputshape.shp"
-        strdir=str(plugin_dir_qgis).strip()
-        #make it cross-platform compatible
-        if os.name == "nt":
-            py_executable = 'python'
-            if str(sys.version)[:1] == '3':
-                py_executable += '3'
-                strdir=strdir.replace(".","").replace("\\","/").replace("//","/")
-                outputshp = strdir+"/"+outputshp
-        elif os.name == "posix":
-            py_executable = 'python'
-        subprocess.call([py_executable,'multi2single.py',inputshp,outputshp])
-        
-        with fiona.open(outputshp) as source:
-            features = list(source)  # copy to list
-        
-            def generator_function(features):
-                for i, feature in enumerate(features):
-                    geometry = shape(feature['geometry'])
-                    yield (i, geometry.bounds, feature)
+            extremes = (np.zeros(0, dtype=np.int64), np.empty(0, dtype=object))
+        
+        if self.backend == 'numpy':
+            self.store = PairStore(*pairs, size=len(features), limit=self.limit)
+            self.store.set_extremes(*extremes)
+            self.store.set_stats(*stats)
+            self.neighbor_extremes()
+            print("Finish neighborsearch, method: " + str(self.method))
+            return
+
+        BulkWriter(self.con, "neighborPairs", PAIR_COLUMNS).write_columns(pairs)
+        BulkWriter(self.con, "locExtreme", ("PolygonID", "Note")).write_columns(extremes)
+        BulkWriter(self.con, "centerStats", STATS_COLUMNS).write_columns(
+            stats[:6] + (localmax.astype(np.int64), localmin.astype(np.int64)))
+
+        # range scans of the selection on the sweep interval
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS index_csMaxAbs ON centerStats ("MaxAbs");""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS index_csMaxDiff ON centerStats ("MaxDiff");""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS index_csMinDiff ON centerStats ("MinDiff");""")
+        self.con.commit()
+        self.neighbor_extremes()
+        self.analyze()
             
-            r = index.Index(generator_function(features))
-
-            fid='UNISTR'
-            val = self.field
-            cluster = 'dbscan'
-            for feature in features:
-                if not(feature['properties'][val] is None):
-                    objval = round(feature['properties'][val],4)
-                    maxval = objval
-                    minval = objval
-                    cond = False
-                    if self.method == 6:
-                        cid = feature['properties'][cluster]
-                    elif self.method == 8:
-                        cid = feature['properties'][self.calfd]
-                    j = 0
-                    k = 0
-                    geometry = shape(feature['geometry'])
-                    
-                    for candidate in list(r.intersection(geometry.bounds)):
-                        
-                        otherfeature = features[candidate]  # using originals, not the copies from the index
-                        
-                        if feature is otherfeature:
-                            continue		    
-                        othergeometry = shape(otherfeature['geometry'])
-                        
-                        if geometry.intersection(othergeometry):
-                            if not(otherfeature['properties'][val] is None):
-                                subval = round(otherfeature['properties'][val],4)
-                                distance = round((geometry.centroid.distance(othergeometry.centroid)),3)
-                                diff = round((objval-subval),4)
-                                if (self.method <= 5 or self.method >= 71):
-                                # All others method
-                                    db_neighborpairs_insert = [feature['properties'][fid],
-                                                               otherfeature['properties'][fid],
-                                                               objval,
-                                                               subval,
-                                                               diff,
-                                                               distance,'','']
-                                    
-                                    cur.execute("""
-                                    INSERT INTO neighborpairs 
-                                        (CenterID, PolygonID, Center, Neighbor, Difference, Distance, CID, PID) 
-                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
-                                    """, db_neighborpairs_insert)
-                                    con.commit()
-                                # Cluster method
-                                if self.method == 6:
-                                    pid = otherfeature['properties'][cluster]
-                                    db_clusters_insert = [feature['properties'][fid],
-                                                           otherfeature['properties'][fid],
-                                                           objval,
-                                                           subval,
-                                                           diff,
-                                                           distance,
-                                                           cid,
-                                                           pid]
-                                
-                                    cur.execute("""
-                                INSERT INTO neighborpairs 
-                                    (CenterID, PolygonID, Center, Neighbor, Difference, Distance, CID, PID) 
-                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        print("Finish neighborsearch, method: " + str(self.method))
+        
+    def neighbor_extremes(self):
+        """Selects the extremes of the neighbors, clusters and nested method
+        
+        These methods have no local extremes, their centers are the ones with
+        a difference above the threshold."""
+        
+        if self.store is not None:
+            self.store.neighbor_extremes(self.method, self.threshold)
+            return
+        # Neighours method
+        if (self.method == 5 or self.method == 73 ):
+            self.cur.execute("""
+                    SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
+                    where (nb."Difference") > {}
+                    group by CenterID order by ABS(nb."Difference") DESC limit {limit};
+                    """.format(self.threshold, limit=self.sql_limit(3000)))
+            db_neighbors_insert = [row for row in self.cur.fetchall()]
+            self.cur.execute("SELECT * FROM locExtreme")
+            if not self.cur.fetchone():        
+               self.cur.executemany("""
+                                INSERT INTO locExtreme 
+                                        (PolygonID, Note) 
+                                        VALUES (?, ?);
+                                """, db_neighbors_insert)
+               self.con.commit()
+            self.cur.execute("""
+                        update "locExtreme"
+                        set "Note" = "neighbors";
+                        """)
+            self.con.commit()
+        # Clusters method
+        if (self.method == 6):
+            self.cur.execute("""
+                    SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
+                    where (nb."Difference") > {} and (nb."CID" = -1 or nb."PID" = -1) and not nb."CID" = nb."PID"
+                    group by CenterID order by ABS(nb."Difference") DESC limit {limit};
+                    """.format(self.threshold, limit=self.sql_limit(3000)))
+            db_clusters_insert = [row for row in self.cur.fetchall()]
+            self.cur.execute("SELECT * FROM locExtreme")
+            if not self.cur.fetchone():        
+               self.cur.executemany("""
+                                INSERT INTO locExtreme 
+                                        (PolygonID, Note) 
+                                        VALUES (?, ?);
                                 """, db_clusters_insert)
-                                    con.commit()
-                                
-                                # Nested method
-                                if self.method == 8:
-                                    pid = otherfeature['properties'][self.calfd]
-                                    db_nested_insert = [feature['properties'][fid],
-                                                           otherfeature['properties'][fid],
-                                                           objval,
-                                                           subval,
-                                                           diff,
-                                                           distance,
-                                                           cid,
-                                                           pid]
-                                    cur.execute("""
-                                INSERT INTO neighborpairs 
-                                    (CenterID, PolygonID, Center, Neighbor, Difference, Distance, CID, PID) 
-                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+               self.con.commit()
+            self.cur.execute("""
+                        update "locExtreme"
+                        set "Note" = "clusters";
+                        """)
+            self.con.commit()
+        # Nested method
+        if (self.method == 8):
+            self.cur.execute("""
+                    SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
+                    where (nb."Difference") > {} and nb."CID" = nb."PID"
+                    group by CenterID order by ABS(nb."Difference") DESC limit {limit};
+                    """.format(self.threshold, limit=self.sql_limit(3000)))
+            db_nested_insert = [row for row in self.cur.fetchall()]       
+            self.cur.execute("SELECT * FROM locExtreme")
+            if not self.cur.fetchone():   
+                self.cur.executemany("""
+                                INSERT INTO locExtreme 
+                                        (PolygonID, Note) 
+                                        VALUES (?, ?);
                                 """, db_nested_insert)
-                                    con.commit()
-                                    
-                                if diff <= 0 and subval >= maxval:
-                                    cond = False
-                                    maxval = subval
-                                    k = 0
-                                if diff >= 0 and subval <= minval:
-                                    cond = False
-                                    minval = subval
-                                    j = 0
-                                if diff > 0 and objval > subval and objval >= maxval: # Local Max
-                                    cond = True
-                                    maxval = objval
-                                    k += 1
-                                if diff < 0 and objval < subval and objval <= minval: # Local Min
-                                    cond = True
-                                    minval = objval
-                                    j += 1
-                    if (self.method <= 3):             
-                        if cond == True and maxval >= objval and j == 0:
-                            db_locmax_insert = [feature['properties'][fid],
-                                                "localmax"]
-                            # if not cur fetchone fehlt!
-                            
-                            cur.execute("""
-                                    INSERT INTO locExtreme 
-                                          (PolygonID, Note) 
-                                           VALUES (?, ?);
-                                    """, db_locmax_insert)
-                            con.commit()
-                            
-                        if cond == True and minval <= objval and k == 0:
-                            db_locmin_insert = [feature['properties'][fid],
-                                                "localmin"]
-                            
-                            #if not cur fetchone fehlt!
-                            cur.execute("""
-                                    INSERT INTO locExtreme 
-                                            (PolygonID, Note) 
-                                            VALUES (?, ?);
-                                    """, db_locmin_insert)
-                            con.commit()
-                    else:
-                       # Hotspot method
-                       if (self.method == 4):
-                           g_bin = int(feature['properties']['Gi_Bin'])
-                           if (g_bin == 3):
-                               db_hotspot_insert = [feature['properties'][fid],
-                                                    "hotspot"]
-                               cur.execute("""
-                                        INSERT INTO locExtreme 
-                                                (PolygonID, Note) 
-                                                VALUES (?, ?);
-                                        """, db_hotspot_insert)
-                               con.commit()
-                           elif (g_bin == -3):
-                               db_coldspot_insert = [feature['properties'][fid],
-                                                    "coldspot"]
-                               cur.execute("""
-                                        INSERT INTO locExtreme 
-                                                (PolygonID, Note) 
-                                                VALUES (?, ?);
-                                        """, db_coldspot_insert)
-                               con.commit()                
-                        
-                source.close()
-                
-                # Neighours method
-                if (self.method == 5 or self.method == 73 ):
-                    cur.execute("""
-                            SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
-                            where (nb."Difference") > {}
-                            group by CenterID order by ABS(nb."Difference") DESC limit 3000;
-                            """.format(self.swp))
-                    db_neighbors_insert = [row for row in cur.fetchall()]
-                    cur.execute("SELECT * FROM locExtreme")
-                    if not cur.fetchone():        
-                       cur.executemany("""
-                                        INSERT INTO locExtreme 
-                                                (PolygonID, Note) 
-                                                VALUES (?, ?);
-                                        """, db_neighbors_insert)
-                       con.commit()
-                    cur.execute("""
-                                update "locExtreme"
-                                set "Note" = "neighbors";
-                                """)
-                    con.commit()
-                # Clusters method
-                if (self.method == 6):
-                    cur.execute("""
-                            SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
-                            where (nb."Difference") > {} and (nb."CID" = -1 or nb."PID" = -1) and not nb."CID" = nb."PID"
-                            group by CenterID order by ABS(nb."Difference") DESC limit 3000;
-                            """.format(self.swp))
-                    db_clusters_insert = [row for row in cur.fetchall()]
-                    cur.execute("SELECT * FROM locExtreme")
-                    if not cur.fetchone():        
-                       cur.executemany("""
-                                        INSERT INTO locExtreme 
-                                                (PolygonID, Note) 
-                                                VALUES (?, ?);
-                                        """, db_clusters_insert)
-                       con.commit()
-                    cur.execute("""
-                                update "locExtreme"
-                                set "Note" = "clusters";
-                                """)
-                    con.commit()
-                # Nested method
-                if (self.method == 8):
-                    cur.execute("""
-                            SELECT distinct(nb."CenterID"), nb."Difference" FROM "neighborPairs" nb
-                            where (nb."Difference") > {} and nb."CID" = nb."PID"
-                            group by CenterID order by ABS(nb."Difference") DESC limit 3000;
-                            """.format(self.swp))
-                    db_nested_insert = [row for row in cur.fetchall()]       
-                    cur.execute("SELECT * FROM locExtreme")
-                    if not cur.fetchone():   
-                        cur.executemany("""
-                                        INSERT INTO locExtreme 
-                                                (PolygonID, Note) 
-                                                VALUES (?, ?);
-                                        """, db_nested_insert)
-                        con.commit()
-                    cur.execute("""
-                                update "locExtreme"
-                                set "Note" = "nested";
-                                """)
-                    con.commit()
-                    
-            print("Finish neighborsearch, method: " + str(self.method))
+                self.con.commit()
+            self.cur.execute("""
+                        update "locExtreme"
+                        set "Note" = "nested";
+                        """)
+            self.con.commit()
         
     def selection(self):
         """Creates a selection of signifcant Center-Neighbor Pairs 
@@ -692,68 +919,92 @@ class aChor(object):
         significance in field values"""
         
         print("Selecting significance sorted center-neighbor-polygon pairs...")
+        if self.sweeps is None:
+            self.report('selection')
+
+        if self.store is not None:
+            self.store.select(self.method, self.threshold)
+            print("Finish selection.\nStarting sweep and generate breaks...")
+            return
 
+        # The aggregates of methods 1, 2, 3 and 5 are taken from centerStats:
+        # a center qualifies by a range condition on its summary, if all of 
+        # its pairs pass the sweep interval the summary is the result, only 
+        # the remaining centers aggregate their pairs
+        
         # sql statement for locExtreme
         if (self.method == 1):
             sql_localextreme = """
-            SELECT  nb."CenterID", MIN(ABS(nb."Difference")), loc."Note" 
-                  FROM "neighborPairs" nb, "locExtreme" loc
-                  WHERE nb."CenterID" = loc."PolygonID" and  ABS(nb."Difference") > {}
-                  GROUP by nb."CenterID", loc."Note"
-                  ORDER by MIN(ABS(nb."Difference")) DESC limit 3000;
-            """.format(self.swp)
-            cur.execute(sql_localextreme)
-            db_selection_localextreme = [row for row in cur.fetchall()]
-    
-            cur.execute("SELECT * FROM locExtremePairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            SELECT cs."CenterID",
+                   CASE WHEN cs."MinAbs" > {0} THEN cs."MinAbs"
+                        ELSE (SELECT MIN(ABS(nb."Difference")) FROM "neighborPairs" nb
+                              WHERE nb."CenterID" = cs."CenterID" and ABS(nb."Difference") > {0}) 
+                   END AS "min",
+                   loc."Note" 
+                  FROM "centerStats" cs, "locExtreme" loc
+                  WHERE cs."CenterID" = loc."PolygonID" and cs."MaxAbs" > {0}
+                  ORDER by "min" DESC, cs."CenterID" limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(3000))
+            self.cur.execute(sql_localextreme)
+            db_selection_localextreme = [row for row in self.cur.fetchall()]
+    
+            self.cur.execute("SELECT * FROM locExtremePairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                 INSERT INTO locExtremePairs (CenterID, min, Note)
                       VALUES (?, ?, ?);""", (db_selection_localextreme))
-                con.commit()
+                self.con.commit()
 
     ################################################################################            
 
         # sql statement for localmax 
         elif (self.method == 2):
             sql_localmax = """
-            SELECT nb."CenterID", MIN(ABS(nb."Difference")), loc."Note"
-                  FROM "neighborPairs" nb, "locExtreme" loc
-                  WHERE nb."CenterID" = loc."PolygonID" and nb."Difference" > {}
-                  GROUP BY nb."CenterID", loc."Note"
-                  ORDER BY MIN(ABS(nb."Difference")) DESC limit 1500;
-            """.format(self.swp)
-            cur.execute(sql_localmax)
-            db_selection_localmax = [row for row in cur.fetchall()]
-    
-            cur.execute("SELECT * FROM locmaxpairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            SELECT cs."CenterID",
+                   CASE WHEN cs."MinDiff" > {0} THEN cs."MinAbs"
+                        ELSE (SELECT MIN(ABS(nb."Difference")) FROM "neighborPairs" nb
+                              WHERE nb."CenterID" = cs."CenterID" and nb."Difference" > {0}) 
+                   END AS "min",
+                   loc."Note"
+                  FROM "centerStats" cs, "locExtreme" loc
+                  WHERE cs."CenterID" = loc."PolygonID" and cs."MaxDiff" > {0}
+                  ORDER BY "min" DESC, cs."CenterID" limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(1500))
+            self.cur.execute(sql_localmax)
+            db_selection_localmax = [row for row in self.cur.fetchall()]
+    
+            self.cur.execute("SELECT * FROM locmaxpairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO locmaxPairs (CenterID, min, Note)
                           VALUES (?, ?, ?);""", (db_selection_localmax))
-                con.commit()
+                self.con.commit()
 
     ################################################################################
 
         # sql statement for locmin
         elif (self.method == 3):
             sql_localmin = """
-            SELECT nb."CenterID", MIN(ABS(nb."Difference")), loc."Note" 
-                  FROM "neighborPairs" nb, "locExtreme" loc
-                  WHERE nb."CenterID" = loc."PolygonID" and nb."Difference" < {}
-                  GROUP BY nb."CenterID", loc."Note"
-                  ORDER BY MIN(ABS(nb."Difference")) DESC limit 1500;
-            """.format(self.swp)
-            cur.execute(sql_localmin)
-            db_selection_localmin = [row for row in cur.fetchall()]
+            SELECT cs."CenterID",
+                   CASE WHEN cs."MaxDiff" < {0} THEN cs."MinAbs"
+                        ELSE (SELECT MIN(ABS(nb."Difference")) FROM "neighborPairs" nb
+                              WHERE nb."CenterID" = cs."CenterID" and nb."Difference" < {0}) 
+                   END AS "min",
+                   loc."Note" 
+                  FROM "centerStats" cs, "locExtreme" loc
+                  WHERE cs."CenterID" = loc."PolygonID" and cs."MinDiff" < {0}
+                  ORDER BY "min" DESC, cs."CenterID" limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(1500))
+            self.cur.execute(sql_localmin)
+            db_selection_localmin = [row for row in self.cur.fetchall()]
     
     
-            cur.execute("SELECT * FROM locminpairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            self.cur.execute("SELECT * FROM locminpairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO locminPairs (CenterID, min, Note)
                           VALUES (?, ?, ?);""", (db_selection_localmin))
-                con.commit()
+                self.con.commit()
         
     ################################################################################
 
@@ -765,40 +1016,45 @@ class aChor(object):
                   WHERE nb."CenterID" = loc."PolygonID" and ABS(nb."Difference") > {}
                   AND NOT (nb."PolygonID" IN (select loc."PolygonID" from "locExtreme" loc))
                   GROUP BY nb."CenterID", nb."Difference", loc."Note"
-                  ORDER BY ABS(nb."Difference") DESC limit 3000;
-            """.format(self.swp)
-            cur.execute(sql_hotspot)
-            db_selection_hotspot = [row for row in cur.fetchall()]
+                  ORDER BY ABS(nb."Difference") DESC limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(3000))
+            self.cur.execute(sql_hotspot)
+            db_selection_hotspot = [row for row in self.cur.fetchall()]
     
     
-            cur.execute("SELECT * FROM hotspotpairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            self.cur.execute("SELECT * FROM hotspotpairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO hotspotPairs (CenterID, min, Note)
                           VALUES (?, ?, ?);""", (db_selection_hotspot))
-                con.commit()
+                self.con.commit()
         
     ################################################################################
     
         # sql statement for neighbors
         elif (self.method == 5  or self.method == 73):
             sql_neighbors = """
-            SELECT nb."CenterID", ABS(nb."Difference"), loc."Note" 
-                  FROM "neighborPairs" nb, "locExtreme" loc
-                  WHERE nb."CenterID" = loc."PolygonID" and ABS(nb."Difference") > {}
-                  GROUP by nb."CenterID", loc."Note"
-                  ORDER by MAX(nb."Difference") DESC limit 3000;
-            """.format(self.swp)
-            cur.execute(sql_neighbors)
-            db_selection_neighbors = [row for row in cur.fetchall()]
+            SELECT "CenterID", ABS("max"), "Note" FROM (
+                SELECT cs."CenterID",
+                       CASE WHEN cs."MinAbs" > {0} THEN cs."MaxDiff"
+                            ELSE (SELECT MAX(nb."Difference") FROM "neighborPairs" nb
+                                  WHERE nb."CenterID" = cs."CenterID" and ABS(nb."Difference") > {0}) 
+                       END AS "max",
+                       loc."Note" 
+                      FROM "centerStats" cs, "locExtreme" loc
+                      WHERE cs."CenterID" = loc."PolygonID" and cs."MaxAbs" > {0})
+                  ORDER by "max" DESC, "CenterID" limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(3000))
+            self.cur.execute(sql_neighbors)
+            db_selection_neighbors = [row for row in self.cur.fetchall()]
     
     
-            cur.execute("SELECT * FROM locExtremePairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            self.cur.execute("SELECT * FROM locExtremePairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO locExtremePairs (CenterID, min, Note)
                           VALUES (?, ?, ?);""", (db_selection_neighbors))
-                con.commit()
+                self.con.commit()
         
     ################################################################################
     
@@ -810,18 +1066,18 @@ class aChor(object):
                   WHERE (nb."Difference" > {}) and (((nb."CID" = -1 or nb."PID" = -1) 
                   and not nb."CID" = nb."PID") or (not(nb."CID" = -1 or nb."PID" = -1) and not nb."CID" = nb."PID"))
                   GROUP by nb."CenterID", ABS(nb."Difference")
-                  ORDER by ABS(nb."Difference") DESC limit 3000;
-            """.format(self.swp)
-            cur.execute(sql_clusters)
-            db_selection_clusters = [row for row in cur.fetchall()]
+                  ORDER by ABS(nb."Difference") DESC limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(3000))
+            self.cur.execute(sql_clusters)
+            db_selection_clusters = [row for row in self.cur.fetchall()]
     
     
-            cur.execute("SELECT * FROM locExtremePairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            self.cur.execute("SELECT * FROM locExtremePairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO locExtremePairs (CenterID, min, Note)
                           VALUES (?, ?, 'clusters');""", (db_selection_clusters))
-                con.commit()
+                self.con.commit()
         
         
      ################################################################################
@@ -832,153 +1088,127 @@ class aChor(object):
             SELECT nb."CenterID", ABS(nb."Difference") FROM "neighborPairs" nb
                   WHERE nb."Difference" > {} and nb."CID" = nb."PID" 
                   GROUP by nb."CenterID", ABS(nb."Difference")
-                  ORDER by ABS(nb."Difference") DESC limit 3000;
-            """.format(self.swp)
-            cur.execute(sql_nested)
-            db_selection_nested = [row for row in cur.fetchall()]
+                  ORDER by ABS(nb."Difference") DESC limit {limit};
+            """.format(self.threshold, limit=self.sql_limit(3000))
+            self.cur.execute(sql_nested)
+            db_selection_nested = [row for row in self.cur.fetchall()]
     
     
-            cur.execute("SELECT * FROM locExtremePairs")
-            if not cur.fetchone():        
-                cur.executemany("""
+            self.cur.execute("SELECT * FROM locExtremePairs")
+            if not self.cur.fetchone():        
+                self.cur.executemany("""
                     INSERT INTO locExtremePairs (CenterID, min, Note)
                           VALUES (?, ?, 'nested');""", (db_selection_nested))
-                con.commit()
+                self.con.commit()
     ################################################################################
+        self.analyze()
         
         print("Finish selection.\nStarting sweep and generate breaks...")
         
-    def linesweep(self):
-        """Performs a line sweep 
+    def fill_line_sweep(self):
+        """Fills the line_sweep table with the selected center-neighbor pairs
+        
+        The table is only (re)filled, if it is empty.
         
-        This function uses the results from the neighborsearch to create a set of 
-        line segments. With these a line sweep is performed to check on which values
-        of the data range the highest amount of intersections occur. 
-
         Returns:
-            A List containing the results of the line sweep as tuples: 
-            Example: 
-            
-            (number of intersections, sweep, [bytes(segment_ids)])
-            
-            ...
-            [(4, 14.4, [bytes(segment_ids)])
-            (6, 14.5, [bytes(segment_ids)]),
-            (6, 14.6, [bytes(segment_ids)])]
-            
-            segment_ids are inserted as a list and then converted to a bytes object 
-            for easier use in the database"""
+            True if the table has been filled, False if it was not empty"""
         
-        segments = []        # will contain line segments according to by significance 
-                             # sorted center-neighbor value ranges
-                             
-        vals = []            # container for the later estimation of dataset parameters
-                             # for iteration
-    
-        cur.execute('SELECT * FROM line_sweep')
-        if not cur.fetchone():
+        if self.store is not None:
+            return self.store.fill_line_sweep(self.method)
+        self.cur.execute('SELECT * FROM line_sweep')
+        if not self.cur.fetchone():
             if self.method == 1:
-                cur.execute("""INSERT INTO line_sweep 
+                self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locExtremePairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min"=ABS(nb."Difference")
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                con.commit()
+                self.con.commit()
             if self.method == 2:
-                 cur.execute("""INSERT INTO line_sweep 
+                 self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locmaxPairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min"=ABS(nb."Difference") and loc."Note"="localmax"
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                 con.commit()
+                 self.con.commit()
             if self.method == 3:
-                 cur.execute("""INSERT INTO line_sweep 
+                 self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locminPairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min"=ABS(nb."Difference") and loc."Note"="localmin"
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                 con.commit()
+                 self.con.commit()
             if self.method == 4:
-                 cur.execute("""INSERT INTO line_sweep 
+                 self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "hotspotPairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min" = ABS(nb."Difference")
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                 con.commit()
+                 self.con.commit()
             if self.method == 5  or self.method == 73:
-                cur.execute("""INSERT INTO line_sweep 
+                self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locExtremePairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min" = ABS(nb."Difference")
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                con.commit()
+                self.con.commit()
             if self.method == 6:
-                cur.execute("""INSERT INTO line_sweep 
+                self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locExtremePairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min" = ABS(nb."Difference")
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                con.commit()
+                self.con.commit()
                 
             if self.method == 8:
-                cur.execute("""INSERT INTO line_sweep 
+                self.cur.execute("""INSERT INTO line_sweep 
                             SELECT loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor", loc."min", loc."Note"
                                         FROM "locExtremePairs" loc, "neighborPairs" nb
                                         WHERE loc."CenterID" = nb."CenterID" and loc."min" = ABS(nb."Difference")
                                         GROUP BY loc."CenterID", nb."PolygonID", nb."Center", nb."Neighbor"
                                         ORDER BY loc."min" DESC;""")
-                con.commit()
+                self.con.commit()
+            return True
+        return False
 
-        cur.execute("SELECT rowid, centerid, polygonid, center, neighbor, min, note FROM line_sweep")
-        data = cur.fetchall()
+    def linesweep(self):
+        """Performs a line sweep 
         
-        # getting data set specific value ranges and create line segments
-        for i, line in enumerate(data):
-
-            # get values for center, neighbor and significance
-            uid = line[0]
-            center_val = line[3]
-            neighbor_val = line[4]
-
-            #create line segments
-            segments.append([uid, LineString([(center_val, i+1), (neighbor_val, i+1)])])
-
-            # get value range
-            vals.append(center_val)
-
-    
-        # dataset parameters for intersection search
-        minval = min(vals)
-        maxval = max(vals)
+        This function uses the results from the neighborsearch to create a set of 
+        line segments. With these a line sweep is performed to check on which values
+        of the data range the highest amount of intersections occur. 
 
+        Returns:
+            A List containing the results of the line sweep as tuples: 
+            Example: 
+            
+            (number of intersections, sweep, [bytes(segment_ids)])
+            
+            ...
+            [(4, 14.4, [bytes(segment_ids)])
+            (6, 14.5, [bytes(segment_ids)]),
+            (6, 14.6, [bytes(segment_ids)])]
             
-        min_dif = self.swp
+            segment_ids are inserted as a list and then converted to a bytes object 
+            for easier use in the database"""
         
+        self.fill_line_sweep()
 
-        # intersection search
-        sweep = minval # set starting point for iteration
+        # line segments from the center to the neighbor value
+        uids, center_vals, neighbor_vals = self.segments()
         
         # result of intersection search, containing: 
         #(# of intersections, sweep, respective segment-ids)
-        intersection = [] 
-    
-        # until the max value of the dataset is not reached the sweep will iterate 
-        # through the value range with the given sweep interval and check for 
-        # intersections with the given set of line segments
-    
-        while sweep <= maxval:
-            match_segments = [segment[0] for i, segment in enumerate(segments) 
-                                if segment[1].contains(Point(sweep, i+1))]
-            
-            intersection.append((len(match_segments), round(sweep,4), [x for x in match_segments]))
-            
-            sweep += min_dif            
+        # the sweep iterates from the min to the max center value with the given
+        # sweep interval, the stabbing counts of all positions are computed at
+        # once from the sorted segment ends
+        intersection = discrete_sweep(uids, center_vals, neighbor_vals, self.swp)
             
         if sys.version_info.major < 3:
             to_db = [(intersection[i][0], 
@@ -993,119 +1223,499 @@ class aChor(object):
         
         return to_db        
         
+    def segments(self):
+        """Returns the ids, center and neighbor values of the line_sweep
+        segments as three lists"""
+        if self.store is not None:
+            return self.store.line_sweep()
+        self.cur.execute("SELECT rowid, center, neighbor FROM line_sweep")
+        data = self.cur.fetchall()
+        if not data:
+            return [], [], []
+        return [list(column) for column in zip(*data)]
+        
+    def exact_linesweep(self):
+        """Performs an exact, event based line sweep
+        
+        Uses the same line segments as linesweep(), but finds the value with
+        the highest amount of intersections from the sorted segment end points
+        instead of stepping through the value range, so no sweep interval is
+        needed.
+        
+        Returns:
+            A tuple (number of intersections, sweep, [segment_ids])"""
+        
+        self.fill_line_sweep()
+        ids, center_vals, neighbor_vals = self.segments()
+        if not ids:
+            return (0, None, [])
+        return exact_sweep(ids, center_vals, neighbor_vals, min(center_vals), max(center_vals))
+        
+    def remove_segments(self, segment_ids):
+        """Deletes evaluated segments from line_sweep and the running sweep
+        
+        Args:
+            segment_ids (list): rowids of the line_sweep segments"""
+        
+        if not segment_ids:
+            return
+        if self.store is not None:
+            self.store.remove(segment_ids)
+        else:
+            self.cur.execute("""DELETE FROM line_sweep 
+                        WHERE rowid IN ({})""".format(','.join(map(str, segment_ids))))
+            self.con.commit()
+        if self.discrete_sweep is not None:
+            self.discrete_sweep.remove(segment_ids)
+        
     def breaks(self):
         """Generates breaks from a linesweep intersection search
         
-            Uses the results from the linesweep()-method to select the breaks
-            based on the intersection count. Checks the output and based on that 
-            deletes the segment lines from the initial line_sweep table and calls 
-            again linesweep() until all segments have been evaluated
+            Selects the breaks based on the intersection count of the discretised 
+            line sweep (or exact_linesweep() in the exact sweep mode). Checks the 
+            output and based on that deletes the segment lines from the initial 
+            line_sweep table, the next call evaluates the remaining segments 
+            until all segments have been evaluated.
+            
+            The discretised sweep keeps its stabbing counts in a DiscreteSweep,
+            so the removed segments are only subtracted from it instead of
+            sweeping the whole value range again for every break.
 
             Returns: 
                 A tuple containing breakvalues from the linesweep and a boolean, 
                 which is set "True" if the last segment has been evaluated
                 
                 (134.03, True) = breakvalue of the last segment
-                (34.2, False) = sweep still running"""
-
-        cur.execute("SELECT * FROM intersection")
-        if not cur.fetchone():
-            cur.executemany("""INSERT INTO intersection
-                                (cnt, sweep, seg)
-                               VALUES (?, ?, ?);""", self.linesweep())
-            con.commit()
+                (34.2, False) = sweep still running
+                (None, True) = there were no segments to sweep"""
+
+        if self.sweep_mode == 'exact':
+            intersection_check, break_val, segment_ids = self.exact_linesweep()
         else:
-            cur.execute("""DELETE FROM intersection""")
-            cur.executemany("""INSERT INTO intersection
-                                (cnt, sweep, seg)
-                               VALUES (?, ?, ?);""", self.linesweep())
-            con.commit()
-        # For the following SQL-statement i got help from stackexchange.
-        # comment how it is done!
-        cur.execute("""WITH uppers(rowid) AS (
-                          SELECT f.rowid FROM intersection f
-                          WHERE cnt = (SELECT MAX(cnt) FROM intersection)
-                          AND NOT EXISTS (
-                              SELECT * FROM intersection s
-                              WHERE s.cnt = f.cnt
-                              AND s.rowid = f.rowid+1)
-                              ),
-                        bounds(lb, ub) AS (
-                          SELECT f.rowid,
-                                 (SELECT u.rowid FROM uppers u
-                                  WHERE u.rowid >= f.rowid
-                                  ORDER BY u.rowid ASC LIMIT 1)
-                                  FROM intersection f
-                                  WHERE cnt = (SELECT MAX(cnt) FROM intersection)
-                                  AND NOT EXISTS (
-                                      SELECT * FROM intersection s
-                                      WHERE s.cnt = f.cnt
-                                      AND s.rowid = f.rowid-1)
-                            )
-                        SELECT (SELECT count(*) FROM intersection
-                                WHERE rowid BETWEEN bounds.lb AND bounds.ub
-                               ) AS count,
-                               (SELECT avg(sweep) FROM intersection
-                                WHERE rowid BETWEEN bounds.lb AND bounds.ub
-                               ) AS avg_sweep,
-                               (SELECT seg FROM intersection
-                                WHERE rowid BETWEEN bounds.lb AND bounds.ub
-                               ) as seg
-                        FROM bounds ORDER BY count DESC, avg_sweep DESC;""") 
-        con.commit()
-
-        data = cur.fetchone()
-        break_val = data[1]
-        segment_ids = data[2]
-        #print(segment_ids.decode('utf-8', 'backslashreplace'))
+            if self.discrete_sweep is None:
+                # the stabbing counts of all sweep positions are built once,
+                # each break only removes its segments from them
+                self.fill_line_sweep()
+                ids, center_vals, neighbor_vals = self.segments()
+                self.discrete_sweep = DiscreteSweep(ids, center_vals, neighbor_vals, self.swp)
+            intersection_check, break_val, segment_ids = self.discrete_sweep.best()
         # deleting the segments from the current intersection search for the next
         # line sweep
-        if sys.version_info.major < 3:
-            del_sql = """DELETE FROM line_sweep 
-                        WHERE rowid IN ({})""".format(','.join(map(str, array.array('L', str(segment_ids)).tolist())))
-        else:
-            del_sql = """DELETE FROM line_sweep 
-                        WHERE rowid IN ({})""".format(','.join(map(str, array.array('L', segment_ids).tolist())))
-        cur.execute(del_sql)
-        con.commit()
+        self.remove_segments(segment_ids)
 
         # check if there are still intersections. If not, select the remaining 
         # single standing segments according to significance
-        cur.execute("""SELECT cnt FROM intersection ORDER BY cnt DESC""")
-        intersection_check = cur.fetchone()[0]
         if intersection_check == 0:
-            cur.execute("""SELECT center, neighbor, min FROM line_sweep ORDER BY min DESC""")
-            data = cur.fetchone()
-            residual_brk_val = (data[0]+data[1])/2
-            del_residual_brk_sql = """DELETE FROM line_sweep WHERE min = {}""".format(data[2])
-            cur.execute(del_residual_brk_sql)
-            con.commit()
+            if self.store is not None:
+                data = self.store.residual()
+            else:
+                self.cur.execute("""SELECT center, neighbor, min FROM line_sweep ORDER BY min DESC, rowid""")
+                data = self.cur.fetchone()
+            if data is None:
+                # the selection is empty, there is nothing to sweep
+                return (None, True)
+            if self.store is not None:
+                residual_brk_val = (data[0]+data[1])/2
+                self.remove_segments(self.store.with_min(data[2]))
+                empty = self.store.is_empty()
+            else:
+                residual_brk_val = (data[0]+data[1])/2
+                self.cur.execute("""SELECT rowid FROM line_sweep WHERE min = {}""".format(data[2]))
+                self.remove_segments([row[0] for row in self.cur.fetchall()])
+                self.cur.execute("SELECT * FROM line_sweep")
+                empty = not self.cur.fetchone()
 
             # check if database empty? if yes return the last value
-            cur.execute("SELECT * FROM line_sweep")
-            if not cur.fetchone():
+            if empty:
                 return (round(residual_brk_val, 4),True)
             
-            self.linesweep()
+            if self.fill_line_sweep():
+                self.discrete_sweep = None
 
             return (round(residual_brk_val, 4),False)
-        # after removing the previously evaluated line segments run the line 
-        # sweep again
-        self.linesweep()
+        # after removing the previously evaluated line segments the next call
+        # sweeps the remaining ones, refill if all of them have been used
+        if self.fill_line_sweep():
+            self.discrete_sweep = None
 
         return (round(break_val,4),False)        
 
-    # con.close()
+
+def classify(layer_path, field, classes, sweep, method=1, calfd='', **kwargs):
+    """Runs an aChor classification in-process and returns the breaks
+    
+    No csv file is written and no python interpreter is started, the breaks
+    are returned directly.
+    
+    Args:
+        layer_path (str): path to the polygon shapefile, or the attribute
+            table (CSV/DBF) with the weights keyword
+        field (str): field to evaluate
+        classes (int): number of desired classes
+        sweep (float): sweep interval
+        method (int): method for evaluation, see the command line help
+        calfd (str): category field for the nested method (optional)
+        **kwargs: further arguments of aChor, e.g. cache, sweep_mode, workdir
+            or weights (GAL/GWT/CSR file) and idfield, analysisdir for the
+            hotspot and cluster methods
+    
+    Returns:
+        brks (list): the break values in the order they were generated"""
+    
+    kwargs.setdefault('csvfile', None)
+    return aChor(classes, sweep, field, layer_path, calfd, method, **kwargs).brks
+
+
+def numeric_fields(layer_path):
+    """Returns the names of all integer and real fields of a shapefile, DBF
+    or CSV table"""
+    if layer_path.lower().endswith('.csv'):
+        records = read_table(layer_path)
+        names = list(records[0]) if records else []
+        return [name for name in names
+                if all(isinstance(record[name], (int, float)) or record[name] is None for record in records)
+                and any(record[name] is not None for record in records)
+                and name not in ('PARTID', 'SRCFID')]
+    with fiona.open(layer_path) as source:
+        properties = source.schema['properties']
+    return [name for name, ftype in properties.items()
+            if ftype.split(':')[0] in ('int', 'int32', 'int64', 'float')
+            and name not in ('PARTID', 'SRCFID')]
+
+
+def classify_fields(layer_path, fields, classes, sweep, method=1, calfd='', workdir=None, **kwargs):
+    """Classifies several fields of one layer with a single neighbor search
+    
+    The geometry stage (explode to single parts and adjacency) only depends
+    on the layer, it is done once and every field is classified on the
+    shared features and edge list.
+    
+    Args:
+        layer_path (str): path to the polygon shapefile, or the attribute
+            table with the weights keyword
+        fields (list): fields to evaluate, None for all numeric fields
+        classes (int): number of desired classes
+        sweep (float): sweep interval
+        method (int): method for evaluation, hotspot (4) and clusters (6)
+            depend on per field input files and are not supported
+        calfd (str): category field for the nested method (optional)
+        workdir (str): directory for the temporary workspaces (optional)
+        **kwargs: further arguments of aChor, e.g. cache, sweep_mode or
+            weights and idfield
+    
+    Returns:
+        results (list): (field, brks) tuples in the order of fields, brks is
+        None for a field whose classification failed (the error is printed
+        and the next field is classified)"""
+    
+    if int(method) in (4, 6):
+        raise ValueError("Method {} can not be run as batch".format(method))
+    if fields is None:
+        fields = [name for name in numeric_fields(layer_path) if name != calfd]
+    kwargs['csvfile'] = None
+    
+    if kwargs.get('weights'):
+        topology = load_weights(kwargs['weights'], layer_path, kwargs.get('idfield'))
+    else:
+        topology = load_topology(layer_path, kwargs.get('cache', True), kwargs.get('contiguity', 'strtree'),
+                                 kwargs.get('snap'), kwargs.get('workers'), kwargs.get('chunksize'), workdir)
+    
+    results = []
+    for field in fields:
+        print("Classifying field {}...".format(field))
+        try:
+            brks = aChor(classes, sweep, field, layer_path, calfd, method,
+                         workdir=workdir, topology=topology, **kwargs).brks
+        except Exception as e:
+            print("Field {} failed: {}: {}".format(field, type(e).__name__, e))
+            brks = None
+        results.append((field, brks))
+    return results
+
+
+def sweep_parameters(layer_path, field, classes, intervals, method=1, calfd='', thresholds=None, **kwargs):
+    """Classifies one field with several sweep intervals and thresholds
+    
+    Adjacency, neighbor pairs and the selection are computed once and reused,
+    only the line sweep runs for every interval. Without thresholds every
+    interval is also the threshold of its selection, like in a single run.
+    
+    Args:
+        layer_path (str): path to the polygon shapefile
+        field (str): field to evaluate
+        classes (int): number of desired classes
+        intervals (list): sweep intervals
+        method (int): method for evaluation, see the command line help
+        calfd (str): category field for the nested method (optional)
+        thresholds (list): selection thresholds, each one is combined with
+            every interval (optional)
+        **kwargs: further arguments of aChor, e.g. cache, sweep_mode or workdir
+    
+    Returns:
+        results (list): (interval, threshold, brks) tuples, intervals vary
+        fastest"""
+    
+    if thresholds is None:
+        sweeps = [(interval, None) for interval in intervals]
+    else:
+        sweeps = [(interval, threshold) for threshold in thresholds for interval in intervals]
+    kwargs['csvfile'] = None
+    return aChor(classes, sweeps[0][0] if sweeps else 0, field, layer_path, calfd, method,
+                 sweeps=sweeps, **kwargs).results
+
+
+def write_breaks_table(csvfile, results, header=('field',)):
+    """Writes one row per result with its keys followed by its breaks
+    
+    Args:
+        csvfile (str): path of the csv file
+        results (list): tuples of the keys in header and the breaks (None
+            for a failed classification, its row has no breaks)
+        header (tuple): column names of the keys"""
+    if sys.version_info.major < 3:
+        fout = open(csvfile, 'wb')
+    else:
+        fout = open(csvfile, 'w', newline='')
+    with fout:
+        writer = csv.writer(fout, delimiter=",")
+        width = max([len(result[-1] or []) for result in results] + [0])
+        writer.writerow(list(header) + ['break{}'.format(i+1) for i in range(width)])
+        for result in results:
+            writer.writerow(list(result[:-1]) + list(result[-1] or []))
+
+
+class JobTimeout(Exception):
+    """Raised inside a batch worker when a job exceeds its time limit"""
+
+
+def _alarm(signum, frame):
+    raise JobTimeout()
+
+
+def read_jobs(source, field=None, method=1, classes=5, sweep=1.0, calfd=''):
+    """Reads the jobs of a batch run from a directory or a manifest
+    
+    A directory yields one job per shapefile with the given field, method,
+    classes and sweep. A manifest is a csv file with the columns shp, field,
+    method, classes, sweep and optionally calfd, relative shapefile paths are
+    resolved against the directory of the manifest. Empty manifest cells
+    take the given defaults.
+    
+    Returns:
+        jobs (list): one dict per job"""
+    
+    defaults = {'field': field, 'method': method, 'classes': classes, 'sweep': sweep, 'calfd': calfd}
+    jobs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith('.shp'):
+                job = dict(defaults)
+                job['shp'] = os.path.join(source, name)
+                jobs.append(job)
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as fin:
+            for row in csv.DictReader(fin):
+                job = dict(defaults)
+                job.update((key, value) for key, value in row.items() if value not in (None, ''))
+                job['shp'] = os.path.join(base, job['shp'])
+                jobs.append(job)
+    for job in jobs:
+        if not job['field']:
+            raise ValueError("No field for {}".format(job['shp']))
+        job['method'] = int(job['method'])
+        job['classes'] = int(job['classes'])
+        job['sweep'] = float(job['sweep'])
+    return jobs
+
+
+def run_job(job, timeout=None, **kwargs):
+    """Classifies a single batch job and never raises
+    
+    The time limit is enforced with SIGALRM where the platform has it,
+    elsewhere the job runs without limit.
+    
+    Returns:
+        The job dict extended with breaks, seconds and error"""
+    
+    result = dict(job)
+    result['breaks'] = []
+    result['error'] = ''
+    use_alarm = timeout and hasattr(signal, 'SIGALRM') \
+        and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _alarm)
+        signal.alarm(int(max(1, round(timeout))))
+    start = time.time()
+    try:
+        result['breaks'] = classify(job['shp'], job['field'], job['classes'], job['sweep'],
+                                    job['method'], job['calfd'], **kwargs)
+    except JobTimeout:
+        result['error'] = "timeout after {}s".format(timeout)
+    except Exception as e:
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def run_batch(jobs, resultfile, workers=None, timeout=None, **kwargs):
+    """Runs batch jobs across a process pool and writes one results file
+    
+    Every job runs in a worker process with its own aChor workspace, a
+    failing or timed out job is recorded in the results file and does not
+    stop the others. The largest shapefiles are submitted first so the
+    pool is not left waiting on a big straggler at the end.
+    
+    Args:
+        jobs (list): job dicts, see read_jobs
+        resultfile (str): csv file for breaks, timings and errors
+        workers (int): number of worker processes (default: cpu count)
+        timeout (float): time limit per job in seconds (optional)
+        **kwargs: further arguments of aChor, e.g. cache or sweep_mode
+    
+    Returns:
+        results (list): result dicts in the order of jobs"""
+    
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    def size(job):
+        try:
+            return os.path.getsize(job['shp'])
+        except OSError:
+            return 0
+    
+    order = sorted(range(len(jobs)), key=lambda i: size(jobs[i]), reverse=True)
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = dict((executor.submit(run_job, jobs[i], timeout, **kwargs), i) for i in order)
+        for done, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                # the worker itself died, e.g. a crash in a native library
+                results[i] = dict(jobs[i], breaks=[], seconds='', error="{}: {}".format(type(e).__name__, e))
+            print("Job {}/{}: {} {} {}".format(done+1, len(jobs), jobs[i]['shp'], jobs[i]['field'],
+                                                results[i]['error'] or "ok"))
+    
+    if sys.version_info.major < 3:
+        fout = open(resultfile, 'wb')
+    else:
+        fout = open(resultfile, 'w', newline='')
+    with fout:
+        writer = csv.writer(fout, delimiter=",")
+        writer.writerow(['shp', 'field', 'method', 'classes', 'sweep', 'calfd', 'seconds', 'error', 'breaks'])
+        for result in results:
+            writer.writerow([result['shp'], result['field'], result['method'], result['classes'],
+                             result['sweep'], result['calfd'], result['seconds'], result['error'],
+                             " ".join(str(brk) for brk in result['breaks'])])
+    return results
+
+
+def batch_main(argv):
+    """Command line of the batch runner: class_achor.py batch <dir or manifest> ..."""
+    parser = argparse.ArgumentParser(prog='class_achor.py batch')
+    parser.add_argument('source', help='directory of shapefiles or csv manifest (shp,field,method,classes,sweep[,calfd])', type=str)
+    parser.add_argument('-f', '--field', help='field to evaluate for jobs without one', type=str)
+    parser.add_argument('-m', '--method', help='method for jobs without one', type=int, default=1)
+    parser.add_argument('-k', '--classes', help='number of classes for jobs without one', type=int, default=5)
+    parser.add_argument('-i', '--swp', help='sweep interval for jobs without one', type=float, default=1.0)
+    parser.add_argument('--calfd', help='category field for nested', type=str, default='')
+    parser.add_argument('-j', '--workers', help='number of worker processes (default: cpu count)', type=int)
+    parser.add_argument('-t', '--timeout', help='time limit per job in seconds', type=float)
+    parser.add_argument('-r', '--results', help='csv file for the results', type=str, default='achorresults.csv')
+    parser.add_argument('-w', '--workdir', help='directory for the temporary workspaces (default: system temp)', type=str)
+    parser.add_argument('--no-cache', help='do not read or write the adjacency cache', action='store_true')
+    parser.add_argument('--contiguity', help='strtree=intersecting polygons, queen/rook=shared vertices/edges of a clean coverage (falls back to strtree otherwise)', choices=ENGINES, default='strtree')
+    parser.add_argument('--snap', help='grid size the vertices are snapped to for queen/rook', type=float)
+    parser.add_argument('--chunksize', help='out-of-core neighbor search, only the geometries of chunks of this many polygons are held in memory', type=int)
+    parser.add_argument('-s', '--sweep-mode', help='interval=discretised sweep with the sweep interval, exact=event based sweep', choices=SWEEP_MODES, default='interval')
+    parser.add_argument('--backend', help='working tables in sqlite or in numpy arrays', choices=BACKENDS, default='sqlite')
+    parser.add_argument('-l', '--limit', help='number of selected candidates, 0=no limit (default: 3000, 1500 for localmax and localmin)', type=int)
+    args = parser.parse_args(argv)
+    
+    start = time.time()
+    jobs = read_jobs(args.source, args.field, args.method, args.classes, args.swp, args.calfd)
+    results = run_batch(jobs, args.results, args.workers, args.timeout, workdir=args.workdir,
+                        cache=not args.no_cache, sweep_mode=args.sweep_mode, backend=args.backend,
+                        limit=args.limit, contiguity=args.contiguity, snap=args.snap, chunksize=args.chunksize)
+    failed = len([result for result in results if result['error']])
+    print("{} jobs, {} failed, execution time: {}s".format(len(results), failed, round(time.time()-start)))
+
+
+def _values(text):
+    return [float(value) for value in text.split(',') if value.strip()]
+
+
+def sweep_main(argv):
+    """Command line of the parameter sweep: class_achor.py sweep <classes> <intervals> <field> <shp> ..."""
+    parser = argparse.ArgumentParser(prog='class_achor.py sweep')
+    parser.add_argument('classes', help='number of desired classes', type=int)
+    parser.add_argument('intervals', help='comma separated sweep intervals', type=_values)
+    parser.add_argument('field', help='field to evaluate', type=str)
+    parser.add_argument('shp', help='shapefile, or attribute table (csv/dbf) with --weights', type=str)
+    parser.add_argument('calfd', help='category field for nested (optional)', type=str, nargs='?', default='')
+    parser.add_argument('--weights', help='precomputed weights (gal, gwt or csr npz), the geometry stage is skipped', type=str)
+    parser.add_argument('--id-field', help='field of the table with the ids of the weights (default: row index)', type=str)
+    parser.add_argument('-t', '--thresholds', help='comma separated selection thresholds, each one is combined with every interval (default: the interval itself)', type=_values)
+    parser.add_argument('-m', '--method', help='method for evaluation, see class_achor.py -h', type=int, default=1)
+    parser.add_argument('-c', '--csvfile', help='csv file for the breaks', type=str, default='achorsweeps.csv')
+    parser.add_argument('-w', '--workdir', help='directory for the temporary workspace (default: system temp)', type=str)
+    parser.add_argument('--no-cache', help='do not read or write the adjacency cache', action='store_true')
+    parser.add_argument('--contiguity', help='strtree=intersecting polygons, queen/rook=shared vertices/edges of a clean coverage (falls back to strtree otherwise)', choices=ENGINES, default='strtree')
+    parser.add_argument('--snap', help='grid size the vertices are snapped to for queen/rook', type=float)
+    parser.add_argument('--chunksize', help='out-of-core neighbor search, only the geometries of chunks of this many polygons are held in memory', type=int)
+    parser.add_argument('--workers', help='processes for a tiled parallel neighbor search (default: serial)', type=int)
+    parser.add_argument('-s', '--sweep-mode', help='interval=discretised sweep with the sweep interval, exact=event based sweep', choices=SWEEP_MODES, default='interval')
+    parser.add_argument('--backend', help='working tables in sqlite or in numpy arrays', choices=BACKENDS, default='sqlite')
+    parser.add_argument('-l', '--limit', help='number of selected candidates, 0=no limit (default: 3000, 1500 for localmax and localmin)', type=int)
+    parser.add_argument('--analysis-dir', help='directory with the hotspot (hotspotshp.dbf) or cluster (inputpoint/inputpoint.dbf) analysis for method 4 and 6', type=str)
+    args = parser.parse_args(argv)
+    
+    start = time.time()
+    results = sweep_parameters(args.shp, args.field, args.classes, args.intervals, args.method, args.calfd,
+                               args.thresholds, workdir=args.workdir, cache=not args.no_cache,
+                               weights=args.weights, idfield=args.id_field,
+                               sweep_mode=args.sweep_mode, backend=args.backend, limit=args.limit,
+                               contiguity=args.contiguity, snap=args.snap, workers=args.workers,
+                               chunksize=args.chunksize, analysisdir=args.analysis_dir)
+    write_breaks_table(args.csvfile, results, ('interval', 'threshold'))
+    print("{} sweeps, execution time: {}s".format(len(results), round(time.time()-start)))
+
+
 if __name__ == "__main__":
-    scriptname = sys.argv[0]
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batch_main(sys.argv[2:])
+        sys.exit()
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        sweep_main(sys.argv[2:])
+        sys.exit()
     parser = argparse.ArgumentParser()
     parser.add_argument('classes', help='number of desired classes', type=int)
     parser.add_argument('swp', help='sweep interval', type=float)
     parser.add_argument('field', help='field to evaluate', type=str)
-    parser.add_argument('shp', help='shapefile', type=str)
+    parser.add_argument('shp', help='shapefile, or attribute table (csv/dbf) with --weights', type=str)
     parser.add_argument('calfd', help='category field for nested (optional)', type=str)
+    parser.add_argument('--weights', help='precomputed weights (gal, gwt or csr npz), the geometry stage is skipped', type=str)
+    parser.add_argument('--id-field', help='field of the table with the ids of the weights (default: row index)', type=str)
     parser.add_argument('-m', '--method', help='method for evaluation 1=localextremes, 2=localmax, 3=localmin, 4=hotspot, 5=neighbors, 6=clusters, 7=globalextreme, 8=nested', type=int)
     parser.add_argument('-o', '--output', help='output to hdd', action='store_true')
+    parser.add_argument('--no-cache', help='do not read or write the adjacency cache', action='store_true')
+    parser.add_argument('--contiguity', help='strtree=intersecting polygons, queen/rook=shared vertices/edges of a clean coverage (falls back to strtree otherwise)', choices=ENGINES, default='strtree')
+    parser.add_argument('--snap', help='grid size the vertices are snapped to for queen/rook', type=float)
+    parser.add_argument('--chunksize', help='out-of-core neighbor search, only the geometries of chunks of this many polygons are held in memory', type=int)
+    parser.add_argument('--workers', help='processes for a tiled parallel neighbor search (default: serial)', type=int)
+    parser.add_argument('-s', '--sweep-mode', help='interval=discretised sweep with the sweep interval, exact=event based sweep', choices=SWEEP_MODES, default='interval')
+    parser.add_argument('--backend', help='working tables in sqlite or in numpy arrays', choices=BACKENDS, default='sqlite')
+    parser.add_argument('-l', '--limit', help='number of selected candidates, 0=no limit (default: 3000, 1500 for localmax and localmin)', type=int)
+    parser.add_argument('-c', '--csvfile', help='csv file for the breaks', type=str, default='achorbreaks.csv')
+    parser.add_argument('-w', '--workdir', help='directory for the temporary workspace (default: system temp)', type=str)
+    parser.add_argument('--analysis-dir', help='directory with the hotspot (hotspotshp.dbf) or cluster (inputpoint/inputpoint.dbf) analysis for method 4 and 6', type=str)
+    parser.add_argument('-b', '--batch', help='field is a comma separated list of fields or * for all numeric fields, one neighbor search for all of them and one csv row per field', action='store_true')
 
     args = parser.parse_args()
 
@@ -1117,6 +1727,19 @@ if __name__ == "__main__":
     calfd=args.calfd
     output = args.output  
     start = time.time()
-    aChor(cls, swp, field, shp, '' if not calfd else calfd, 1 if not method else method, 0 if output else 0)
+    if args.batch:
+        fields = None if field == '*' else [f.strip() for f in field.split(',') if f.strip()]
+        results = classify_fields(shp, fields, cls, swp, 1 if not method else method, '' if not calfd else calfd,
+                                  args.workdir, memory=0 if output else 0, cache=not args.no_cache,
+                                  sweep_mode=args.sweep_mode, backend=args.backend, limit=args.limit,
+                                  weights=args.weights, idfield=args.id_field,
+                                  contiguity=args.contiguity, snap=args.snap, workers=args.workers,
+                                  chunksize=args.chunksize, analysisdir=args.analysis_dir)
+        write_breaks_table(args.csvfile, results)
+    else:
+        aChor(cls, swp, field, shp, '' if not calfd else calfd, 1 if not method else method, 0 if output else 0, not args.no_cache,
+              args.sweep_mode, args.csvfile, args.workdir, backend=args.backend, limit=args.limit,
+              weights=args.weights, idfield=args.id_field, contiguity=args.contiguity, snap=args.snap,
+              workers=args.workers, chunksize=args.chunksize, analysisdir=args.analysis_dir)
     print("Execution time: {}s".format(round(time.time()-start)))
     
@@ -0,0 +1,379 @@
+"""Columnar NumPy backend for the aChor working tables
+
+The SQLite backend keeps the neighbour pairs, the local extremes, the
+selection and the line sweep segments in tables and evaluates the per
+method queries with GROUP BY/ORDER BY. The PairStore keeps the same data as
+parallel NumPy arrays, sorted and CSR-indexed by center, and answers the
+same queries with array reductions.
+
+The queries follow the SQLite semantics of the SQL statements in
+class_achor.py: pairs are scanned in (CenterID, PolygonID) order, a bare
+column of a GROUP BY without aggregate comes from the first row of the
+group, a bare column next to MIN/MAX from the row of the extreme and ties
+of an ORDER BY keep the scan order."""
+
+import numpy as np
+
+
+def group_starts(keys):
+    """Returns the start of each run of equal values in sorted keys"""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def center_stats(center_id, difference):
+    """Summarises the pairs of every center (centerStats)
+
+    A center is a local maximum if it is not lower than any of its
+    neighbors and higher than at least one of them, a local minimum the
+    other way round. So a plateau of equal values can still be an extreme.
+    Both follow from the extreme differences of the center, so they do not
+    depend on the order in which the neighbors are visited.
+
+    Args:
+        center_id (numpy.ndarray): center ids of the pairs, sorted
+        difference (numpy.ndarray): center minus neighbor value of the pairs
+
+    Returns:
+        A tuple of arrays (ids, degree, min difference, max difference,
+        min absolute difference, max absolute difference, local max,
+        local min) with one entry per center"""
+
+    starts = group_starts(center_id)
+    if len(starts) == 0:
+        empty = np.zeros(0)
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), empty, empty, empty, empty,
+                np.zeros(0, dtype=bool), np.zeros(0, dtype=bool))
+    absdiff = np.abs(difference)
+    min_diff = np.minimum.reduceat(difference, starts)
+    max_diff = np.maximum.reduceat(difference, starts)
+    return (center_id[starts], np.diff(np.r_[starts, len(center_id)]), min_diff, max_diff,
+            np.minimum.reduceat(absdiff, starts), np.maximum.reduceat(absdiff, starts),
+            (min_diff >= 0) & (max_diff > 0), (max_diff <= 0) & (min_diff < 0))
+
+
+def candidate_limit(limit, default):
+    """Resolves the number of selected candidates
+
+    Args:
+        limit (int): None for the default of the method, 0 for no limit
+        default (int): default of the method
+
+    Returns:
+        The maximum number of candidates or None for no limit"""
+    if limit is None:
+        return default
+    if int(limit) < 0:
+        raise ValueError("Candidate limit must not be negative: {}".format(limit))
+    return int(limit) or None
+
+
+def top(values, limit=None):
+    """Returns the indices of the largest values in descending order
+
+    Ties keep their order, at most limit indices are returned (all for
+    None). With a limit only the candidates down to the limit-th largest
+    value are sorted, which are found with a partial sort."""
+    values = np.asarray(values, dtype=np.float64)
+    if limit is not None and limit < len(values):
+        if limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+        kth = -np.partition(-values, limit - 1)[limit - 1]
+        candidates = np.flatnonzero(values >= kth)
+        order = candidates[np.argsort(-values[candidates], kind='stable')]
+        return order[:limit]
+    return np.argsort(-values, kind='stable')
+
+
+class PairStore(object):
+    """Neighbour pairs, local extremes, selection and line sweep segments
+    as NumPy arrays
+
+    Args:
+        center_id, polygon_id (numpy.ndarray): ids of the pairs, sorted by
+            center and polygon id
+        center, neighbor, difference, distance (numpy.ndarray): values of
+            the pairs
+        cid, pid (numpy.ndarray): category of center and neighbor (object
+            arrays, only used by the cluster and nested method)
+        size (int): number of polygon ids (default: highest id in the pairs)
+        limit (int): number of selected candidates, see candidate_limit"""
+
+    def __init__(self, center_id, polygon_id, center, neighbor, difference, distance, cid, pid, size=None,
+                 limit=None):
+        self.center_id = np.asarray(center_id, dtype=np.int64)
+        self.polygon_id = np.asarray(polygon_id, dtype=np.int64)
+        self.center = np.asarray(center, dtype=np.float64)
+        self.neighbor = np.asarray(neighbor, dtype=np.float64)
+        self.difference = np.asarray(difference, dtype=np.float64)
+        self.absdiff = np.abs(self.difference)
+        self.distance = np.asarray(distance, dtype=np.float64)
+        self.cid = cid
+        self.pid = pid
+
+        if size is None:
+            size = int(max(self.center_id.max(), self.polygon_id.max())) + 1 if len(self.center_id) else 0
+        self.size = size
+        self.limit = limit
+        self.indptr = np.searchsorted(self.center_id, np.arange(size + 1))
+
+        # locExtreme: flag and note per polygon id
+        self.extreme = np.zeros(size, dtype=bool)
+        self.notes = np.empty(size, dtype=object)
+        # centerStats: summary of the pairs per center id
+        self.degree = np.zeros(size, dtype=np.int64)
+        self.min_diff = np.zeros(size)
+        self.max_diff = np.zeros(size)
+        self.min_abs = np.zeros(size)
+        self.max_abs = np.zeros(size)
+        self.localmax = np.zeros(size, dtype=bool)
+        self.localmin = np.zeros(size, dtype=bool)
+        # locExtremePairs/locmaxPairs/...: selected (CenterID, min, Note)
+        self.selected = (np.zeros(0, dtype=np.int64), np.zeros(0), np.empty(0, dtype=object))
+        # line_sweep: segments and the mask of the not yet evaluated ones
+        self.segments = None
+        self.alive = np.zeros(0, dtype=bool)
+
+    # --- neighbour search -------------------------------------------------
+
+    def set_extremes(self, ids, notes):
+        """Inserts local extremes (locExtreme)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.extreme[ids] = True
+        self.notes[ids] = list(notes)
+
+    def set_stats(self, ids, degree, min_diff, max_diff, min_abs, max_abs, localmax, localmin):
+        """Inserts the per center summary (centerStats)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.degree[ids] = degree
+        self.min_diff[ids] = min_diff
+        self.max_diff[ids] = max_diff
+        self.min_abs[ids] = min_abs
+        self.max_abs[ids] = max_abs
+        self.localmax[ids] = np.asarray(localmax, dtype=bool)
+        self.localmin[ids] = np.asarray(localmin, dtype=bool)
+
+    def aggregate(self, qualify, complete, summary, mask, reduce):
+        """Aggregates the filtered pairs per center with help of centerStats
+
+        Args:
+            qualify (numpy.ndarray): per center, some pair passes the filter
+            complete (numpy.ndarray): per center, all pairs pass the filter
+            summary (numpy.ndarray): per center, the result if complete
+            mask (numpy.ndarray): per pair, the pair passes the filter
+            reduce (numpy.ufunc): np.minimum or np.maximum
+
+        Returns:
+            A tuple (ids, values) of the qualifying centers in id order"""
+
+        ids = np.flatnonzero(qualify)
+        values = summary[ids]
+        partial = qualify & ~complete
+        if partial.any():
+            # only the centers with some filtered out pairs look at them
+            rows = np.flatnonzero(partial[self.center_id] & mask)
+            starts = group_starts(self.center_id[rows])
+            at = np.searchsorted(ids, self.center_id[rows][starts])
+            values[at] = reduce.reduceat(self.difference[rows] if reduce is np.maximum
+                                         else self.absdiff[rows], starts)
+        return ids, values
+
+    def categories(self):
+        """Compares the categories of center and neighbor per pair
+
+        Returns:
+            A tuple of boolean arrays (same, noise, valid), comparisons with
+            NULL are false like in SQL. same: "CID" = "PID", noise: "CID" = -1
+            or "PID" = -1, valid: neither is NULL"""
+        cid = np.asarray(self.cid, dtype=object)
+        pid = np.asarray(self.pid, dtype=object)
+        valid = np.not_equal(cid, None) & np.not_equal(pid, None)
+        same = np.equal(cid, pid).astype(bool) & valid
+        noise = (np.equal(cid, -1).astype(bool) | np.equal(pid, -1).astype(bool)) & valid
+        return same, noise, valid
+
+    def neighbor_extremes(self, method, swp):
+        """Selects the extremes of the neighbors, cluster and nested method
+
+        The centers with a pair above the sweep interval, ordered by the
+        absolute difference of their first such pair."""
+
+        names = {5: "neighbors", 73: "neighbors", 6: "clusters", 8: "nested"}
+        if method not in names:
+            return
+        if not self.extreme.any():
+            mask = self.difference > swp
+            if method == 6:
+                same, noise, valid = self.categories()
+                mask &= noise & ~same & valid
+            elif method == 8:
+                mask &= self.categories()[0]
+            rows = np.flatnonzero(mask)
+            first = rows[group_starts(self.center_id[rows])]
+            first = first[top(self.absdiff[first], candidate_limit(self.limit, 3000))]
+            self.extreme[self.center_id[first]] = True
+        self.notes[self.extreme] = names[method]
+
+    # --- global extremes --------------------------------------------------
+
+    def global_break(self):
+        """Breaks between the global extremes and their closest neighbor"""
+        rows = np.flatnonzero(self.center_id != self.polygon_id)
+        lowest = rows[np.lexsort((self.absdiff[rows], self.center[rows]))[0]]
+        highest = rows[np.lexsort((self.absdiff[rows], -self.center[rows]))[0]]
+        return {"Min": float(self.center[lowest] + self.neighbor[lowest]) / 2,
+                "Max": float(self.center[highest] + self.neighbor[highest]) / 2}
+
+    def inbetween_values(self):
+        """Distinct center values in scan order without the first and last"""
+        index = np.unique(self.center, return_index=True)[1]
+        values = self.center[np.sort(index)].tolist()
+        del values[0]
+        del values[-1]
+        return values
+
+    # --- selection ----------------------------------------------------------
+
+    def select(self, method, swp):
+        """Selects the significant center-neighbor pairs of a method"""
+
+        cid = self.center_id
+        extreme = self.extreme[cid]
+        if method == 1:
+            mask = extreme & (self.absdiff > swp)
+        elif method == 2:
+            mask = extreme & (self.difference > swp)
+        elif method == 3:
+            mask = extreme & (self.difference < swp)
+        elif method == 4:
+            mask = extreme & (self.absdiff > swp) & ~self.extreme[self.polygon_id]
+        elif method in (5, 73):
+            mask = extreme & (self.absdiff > swp)
+        elif method == 6:
+            same, noise, valid = self.categories()
+            mask = (self.difference > swp) & ~same & valid
+        elif method == 8:
+            mask = (self.difference > swp) & self.categories()[0]
+        else:
+            return
+
+        if method == 1:
+            # MIN(ABS("Difference")) per center
+            ids, values = self.aggregate(self.extreme & (self.max_abs > swp), self.min_abs > swp,
+                                         self.min_abs, mask, np.minimum)
+            order = top(values, candidate_limit(self.limit, 3000))
+            notes = self.notes[ids[order]]
+        elif method == 2:
+            ids, values = self.aggregate(self.extreme & (self.max_diff > swp), self.min_diff > swp,
+                                         self.min_abs, mask, np.minimum)
+            order = top(values, candidate_limit(self.limit, 1500))
+            notes = self.notes[ids[order]]
+        elif method == 3:
+            ids, values = self.aggregate(self.extreme & (self.min_diff < swp), self.max_diff < swp,
+                                         self.min_abs, mask, np.minimum)
+            order = top(values, candidate_limit(self.limit, 1500))
+            notes = self.notes[ids[order]]
+        elif method in (5, 73):
+            # ABS("Difference") of the pair with MAX("Difference") per center
+            ids, maxdiff = self.aggregate(self.extreme & (self.max_abs > swp), self.min_abs > swp,
+                                          self.max_diff, mask, np.maximum)
+            values = np.abs(maxdiff)
+            order = top(maxdiff, candidate_limit(self.limit, 3000))
+            notes = self.notes[ids[order]]
+        else:
+            # distinct (CenterID, ABS("Difference"))
+            rows = np.flatnonzero(mask)
+            keys = np.lexsort((self.absdiff[rows], cid[rows]))
+            rows = rows[keys]
+            new = np.r_[True, (cid[rows][1:] != cid[rows][:-1]) |
+                              (self.absdiff[rows][1:] != self.absdiff[rows][:-1])] if len(rows) else np.zeros(0, dtype=bool)
+            rows = rows[new]
+            ids = cid[rows]
+            values = self.absdiff[rows]
+            order = top(values, candidate_limit(self.limit, 3000))
+            if method == 4:
+                notes = self.notes[ids[order]]
+            else:
+                notes = np.array([{6: "clusters", 8: "nested"}[method]] * len(order), dtype=object)
+        self.selected = (ids[order], values[order], notes)
+
+    # --- line sweep ---------------------------------------------------------
+
+    def fill_line_sweep(self, method):
+        """Fills the line sweep segments with the pairs of the selected
+        centers whose absolute difference equals the selected min
+
+        The segments are only (re)filled, if none is left.
+
+        Returns:
+            True if the segments have been filled, False otherwise"""
+
+        if self.alive.any():
+            return False
+        ids, values, notes = self.selected
+        if method == 2:
+            keep = notes == "localmax"
+        elif method == 3:
+            keep = notes == "localmin"
+        else:
+            keep = np.ones(len(ids), dtype=bool)
+        ids, values, notes = ids[keep], values[keep], notes[keep]
+
+        # all pairs of the selected centers, one block per selected row
+        begin = self.indptr[ids]
+        count = self.indptr[ids + 1] - begin
+        owner = np.repeat(np.arange(len(ids)), count)
+        rows = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(begin, count)
+        match = self.absdiff[rows] == values[owner]
+        owner, rows = owner[match], rows[match]
+        # GROUP BY the pair
+        rows, first = np.unique(rows, return_index=True)
+        owner = owner[first]
+        order = top(values[owner])
+        rows, owner = rows[order], owner[order]
+
+        self.segments = (self.center[rows], self.neighbor[rows], values[owner])
+        self.alive = np.ones(len(rows), dtype=bool)
+        return True
+
+    def line_sweep(self):
+        """Returns ids, center and neighbor values of the remaining segments"""
+        ids = np.flatnonzero(self.alive)
+        return ids.tolist(), self.segments[0][ids].tolist(), self.segments[1][ids].tolist()
+
+    def remove(self, ids):
+        """Removes evaluated segments"""
+        self.alive[np.asarray(ids, dtype=np.int64)] = False
+
+    def clear_line_sweep(self):
+        """Drops the remaining segments, the next fill restores all of them"""
+        self.alive = np.zeros(0, dtype=bool)
+
+    def clear_selection(self, method):
+        """Drops the selection and, for the methods which select them by
+        the threshold, the extremes"""
+        if method in (5, 6, 8, 73):
+            self.extreme[:] = False
+            self.notes[:] = None
+        self.selected = (np.zeros(0, dtype=np.int64), np.zeros(0), np.empty(0, dtype=object))
+        self.segments = None
+        self.clear_line_sweep()
+
+    def is_empty(self):
+        return not self.alive.any()
+
+    def residual(self):
+        """Returns (center, neighbor, min) of the remaining segment with the
+        highest min, ties go to the first segment (like the rowid order of
+        the sqlite backend)"""
+        ids = np.flatnonzero(self.alive)
+        if len(ids) == 0:
+            return None
+        values = self.segments[2][ids]
+        best = ids[np.argmax(values)]
+        return float(self.segments[0][best]), float(self.segments[1][best]), float(self.segments[2][best])
+
+    def with_min(self, value):
+        """Returns the ids of the remaining segments with the given min"""
+        return np.flatnonzero(self.alive & (self.segments[2] == value)).tolist()
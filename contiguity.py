@@ -0,0 +1,379 @@
+"""Contiguity engines for the aChor neighbour search
+
+The functions in this module take a list of already parsed shapely polygons
+and return the polygon adjacency as an edge list of NumPy arrays. Every
+geometry is parsed exactly once by the caller, the engines only run bulk
+predicate queries on top of it.
+
+For clean coverages (neighbours share their boundary vertices) the
+topology engines derive queen or rook contiguity from shared vertices or
+edges instead, without a predicate per pair. Coverages where this does not
+hold fall back to the predicate engine.
+
+The predicate engine can be split into spatial tiles which are searched
+in parallel worker processes, see tiled_contiguity."""
+
+import numpy as np
+import shapely
+
+try:
+    from shapely import STRtree
+    SHAPELY2 = int(shapely.__version__.split('.')[0]) >= 2
+except ImportError:
+    SHAPELY2 = False
+
+ENGINES = ('strtree', 'queen', 'rook')
+
+
+def build_contiguity(geometries, engine='strtree', snap=None, workers=None):
+    """Finds the adjacent pairs with the given contiguity engine
+
+    Args:
+        geometries (numpy.ndarray): shapely geometries
+        engine (str): 'strtree' for all intersecting pairs, 'queen' for
+            pairs sharing a vertex, 'rook' for pairs sharing an edge
+        snap (float): grid size the vertices are snapped to before they are
+            compared (topology engines only, default: exact coordinates)
+        workers (int): number of processes of the predicate engine, more
+            than one searches spatial tiles in parallel (default: serial)
+
+    Returns:
+        A tuple (center, neighbor), see strtree_contiguity"""
+
+    if engine not in ENGINES:
+        raise ValueError("Unknown contiguity engine: {}".format(engine))
+    rook = engine == 'rook'
+    if engine != 'strtree' and SHAPELY2:
+        pairs = topology_contiguity(geometries, rook, snap)
+        if pairs is not None:
+            return pairs
+        print("Polygons do not form a clean coverage, using the predicate engine")
+    if workers is not None and workers > 1 and SHAPELY2:
+        return tiled_contiguity(geometries, workers, rook=rook)
+    return strtree_contiguity(geometries, rook)
+
+
+def strtree_contiguity(geometries, rook=False):
+    """Finds all pairs of intersecting geometries with one bulk query
+
+    With shapely 2 a single STRtree.query(..., predicate="intersects") call
+    evaluates all candidate pairs inside GEOS. For older shapely versions an
+    rtree index and prepared geometries are used instead, which still avoids
+    building an intersection geometry for each candidate pair.
+
+    Args:
+        geometries (numpy.ndarray): shapely geometries
+        rook (bool): only keep pairs whose boundaries share a line
+
+    Returns:
+        A tuple of two int64 arrays (center, neighbor) holding the indices of
+        every directed adjacent pair, sorted by center and neighbor. Self
+        pairs are removed."""
+
+    if SHAPELY2:
+        tree = STRtree(geometries)
+        center, neighbor = tree.query(geometries, predicate="intersects")
+    else:
+        center, neighbor = _rtree_contiguity(geometries)
+    center = np.asarray(center, dtype=np.int64)
+    neighbor = np.asarray(neighbor, dtype=np.int64)
+
+    keep = center != neighbor
+    center = center[keep]
+    neighbor = neighbor[keep]
+    if rook:
+        if SHAPELY2:
+            keep = shapely.relate_pattern(geometries[center], geometries[neighbor], '****1****')
+        else:
+            keep = np.array([geometries[i].relate_pattern(geometries[j], '****1****')
+                             for i, j in zip(center, neighbor)], dtype=bool)
+        center = center[keep]
+        neighbor = neighbor[keep]
+    order = np.lexsort((neighbor, center))
+    return center[order], neighbor[order]
+
+
+def _pack(first, second):
+    """Packs pairs of non-negative ints into one int64 key, sorting the
+    keys sorts the pairs by first and second"""
+    width = int(second.max()) + 1 if len(second) else 1
+    return first.astype(np.int64) * width + second
+
+
+def _distinct(values):
+    """Sorted distinct values of an int array"""
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+
+def _vertex_ids(x, y):
+    """Numbers the distinct coordinates (x, y)
+
+    The coordinates are hashed to one 64 bit key, a (very unlikely) hash
+    collision is detected and resolved by sorting the coordinates instead.
+
+    Returns:
+        A tuple (ids, index), where ids is the vertex id of every
+        coordinate and index the first coordinate of every vertex id"""
+
+    x = x + 0.0  # -0.0 == 0.0
+    y = y + 0.0
+    keys = (x.view(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ y.view(np.uint64)
+    index, ids = np.unique(keys, return_index=True, return_inverse=True)[1:]
+    ids = ids.ravel()
+    if (x[index][ids] != x).any() or (y[index][ids] != y).any():
+        order = np.lexsort((y, x))
+        new = np.r_[True, (x[order][1:] != x[order][:-1]) | (y[order][1:] != y[order][:-1])]
+        ids = np.empty(len(order), dtype=np.int64)
+        ids[order] = np.cumsum(new) - 1
+        index = order[new]
+    return ids, index
+
+
+def _shared_keys(keys, owner):
+    """Returns all directed pairs of owners sharing a key
+
+    Args:
+        keys (numpy.ndarray): hash key (vertex or edge id) of every item
+        owner (numpy.ndarray): polygon index of every item"""
+
+    items = _distinct(_pack(keys, owner))
+    width = int(owner.max()) + 1 if len(owner) else 1
+    keys, owner = items // width, items % width
+    center = []
+    neighbor = []
+    # keys are sorted, so an item and the one shift places further share
+    # their key exactly if the group of the key is larger than shift
+    shift = 1
+    while shift < len(keys):
+        same = keys[shift:] == keys[:-shift]
+        if not same.any():
+            break
+        first, second = owner[:-shift][same], owner[shift:][same]
+        center.extend((first, second))
+        neighbor.extend((second, first))
+        shift += 1
+    if not center:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pairs = _distinct(_pack(np.concatenate(center), np.concatenate(neighbor)))
+    return pairs // width, pairs % width
+
+
+def _coverage_is_clean(points, edges, count):
+    """Checks that the boundary edges of a coverage only meet at vertices
+
+    In a clean coverage an edge belongs to one or two polygons, and the
+    edges of only one polygon (the outer boundary and holes) meet only at
+    shared vertices. A vertex on another polygon's edge (a T-junction),
+    crossing edges and overlaps break this. Only the boundary edges are
+    checked with the spatial index.
+
+    Args:
+        points (numpy.ndarray): coordinates of the vertex ids
+        edges (numpy.ndarray): vertex ids (start, end) of every distinct edge
+        count (numpy.ndarray): number of polygon rings using each edge"""
+
+    if (count > 2).any():
+        return False
+    edges = edges[count == 1]
+    if len(edges) == 0:
+        return True
+    lines = shapely.linestrings(np.stack((points[edges[:, 0]], points[edges[:, 1]]), axis=1))
+    first, second = STRtree(lines).query(lines, predicate="intersects")
+    keep = first < second
+    first, second = first[keep], second[keep]
+    a, b = edges[first], edges[second]
+    # boundary edges touching at a common vertex are fine unless they run
+    # along each other
+    common = np.where((a[:, 0] == b[:, 0]) | (a[:, 0] == b[:, 1]), a[:, 0],
+                      np.where((a[:, 1] == b[:, 0]) | (a[:, 1] == b[:, 1]), a[:, 1], -1))
+    if (common < 0).any():
+        return False
+    other_a = np.where(a[:, 0] == common, a[:, 1], a[:, 0])
+    other_b = np.where(b[:, 0] == common, b[:, 1], b[:, 0])
+    u = points[other_a] - points[common]
+    v = points[other_b] - points[common]
+    cross = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+    dot = (u * v).sum(axis=1)
+    return not ((cross == 0) & (dot > 0)).any()
+
+
+def topology_contiguity(geometries, rook=False, snap=None):
+    """Finds adjacent pairs of a clean coverage by hashing shared vertices
+    or edges
+
+    The coordinates of all rings are (optionally snapped and) hashed to
+    vertex ids in one pass, two polygons are queen neighbours if they share
+    a vertex id and rook neighbours if they share an edge, i.e. the same
+    pair of consecutive vertex ids. No geometry predicate is evaluated per
+    pair. Needs shapely 2.
+
+    Args:
+        geometries (numpy.ndarray): shapely polygons
+        rook (bool): pairs sharing an edge instead of a vertex
+        snap (float): grid size the vertices are snapped to (optional)
+
+    Returns:
+        A tuple (center, neighbor) like strtree_contiguity or None, if the
+        polygons do not form a clean coverage"""
+
+    rings, polygon = shapely.get_rings(geometries, return_index=True)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    grid = np.round(coords / snap) if snap else coords
+    vertex, first = _vertex_ids(grid[:, 0], grid[:, 1])
+    points = coords[first]
+    owner = polygon[ring]
+
+    # edges between consecutive vertices of a ring, stored as (low, high)
+    # vertex id, zero length edges from snapping are dropped
+    segment = np.flatnonzero((ring[1:] == ring[:-1]) & (vertex[1:] != vertex[:-1]))
+    low = np.minimum(vertex[segment], vertex[segment + 1])
+    high = np.maximum(vertex[segment], vertex[segment + 1])
+    first, edge, count = np.unique(_pack(low, high), return_index=True, return_inverse=True,
+                                   return_counts=True)[1:]
+    edge = edge.ravel()
+    edges = np.column_stack((low[first], high[first]))
+    if not _coverage_is_clean(points, edges, count):
+        return None
+
+    if rook:
+        return _shared_keys(edge, owner[segment])
+    return _shared_keys(vertex, owner)
+
+
+def split_tiles(bounds, tiles):
+    """Splits features into spatial tiles of about the same size
+
+    The features are ordered into vertical strips by the x of their
+    bounding box center and every strip into tiles by y, the features of
+    a tile are the ones whose center lies in it.
+
+    Args:
+        bounds (numpy.ndarray): (minx, miny, maxx, maxy) of every feature
+        tiles (int): number of tiles
+
+    Returns:
+        tiles (list): int64 index arrays, one per non-empty tile"""
+
+    x = (bounds[:, 0] + bounds[:, 2]) / 2
+    y = (bounds[:, 1] + bounds[:, 3]) / 2
+    columns = max(1, int(round(np.sqrt(tiles))))
+    rows = max(1, int(np.ceil(tiles / float(columns))))
+    result = []
+    for strip in np.array_split(np.argsort(x, kind='stable'), columns):
+        for tile in np.array_split(strip[np.argsort(y[strip], kind='stable')], rows):
+            if len(tile):
+                result.append(np.sort(tile))
+    return result
+
+
+def _tile_pairs(owned, candidates, wkb, rook):
+    """Worker of tiled_contiguity: adjacent pairs of the owned features
+
+    Args:
+        owned (numpy.ndarray): positions of the owned features in candidates
+        candidates (numpy.ndarray): global indices of the tile and its halo
+        wkb (numpy.ndarray): WKB of the candidate geometries
+        rook (bool): see strtree_contiguity
+
+    Returns:
+        A tuple (center, neighbor) of global indices"""
+
+    geometries = shapely.from_wkb(wkb)
+    center, neighbor = STRtree(geometries).query(geometries[owned], predicate="intersects")
+    center = owned[center]
+    if rook:
+        keep = (center != neighbor) & shapely.relate_pattern(geometries[center], geometries[neighbor], '****1****')
+        center, neighbor = center[keep], neighbor[keep]
+    return candidates[center], candidates[neighbor]
+
+
+def tiled_contiguity(geometries, workers, tiles=None, rook=False):
+    """Finds all pairs of intersecting geometries, tile by tile in parallel
+
+    Every feature belongs to one tile (split_tiles). The halo of a tile are
+    all features whose bounding box intersects the bounding box of the
+    tile's own features, so it holds every possible neighbour of them.
+    Each worker process searches the pairs of the own features of its tile
+    among the tile and its halo. Every pair is found by the tile of its
+    center only, the merged, deduplicated and sorted pairs are exactly the
+    ones of strtree_contiguity. Needs shapely 2.
+
+    Args:
+        geometries (numpy.ndarray): shapely geometries
+        workers (int): number of worker processes
+        tiles (int): number of tiles (default: 4 per worker)
+        rook (bool): see strtree_contiguity
+
+    Returns:
+        A tuple (center, neighbor), see strtree_contiguity"""
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    tiles = tiles or 4 * workers
+    bounds = shapely.bounds(geometries)
+    if len(geometries) < 2 * tiles:
+        return strtree_contiguity(geometries, rook)
+
+    jobs = []
+    for own in split_tiles(bounds, tiles):
+        box = bounds[own]
+        minx, miny = box[:, 0].min(), box[:, 1].min()
+        maxx, maxy = box[:, 2].max(), box[:, 3].max()
+        candidates = np.flatnonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) &
+                                    (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+        owned = np.searchsorted(candidates, own)
+        jobs.append((owned, candidates, shapely.to_wkb(geometries[candidates]), rook))
+
+    center = []
+    neighbor = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for tile_center, tile_neighbor in executor.map(_tile_pairs, *zip(*jobs)):
+            center.append(tile_center)
+            neighbor.append(tile_neighbor)
+    center = np.concatenate(center).astype(np.int64)
+    neighbor = np.concatenate(neighbor).astype(np.int64)
+
+    keep = center != neighbor
+    pairs = np.unique(np.column_stack((center[keep], neighbor[keep])), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _rtree_contiguity(geometries):
+    """Fallback for shapely < 2 using rtree and prepared geometries"""
+
+    from rtree import index
+    from shapely.prepared import prep
+
+    r = index.Index((i, geometry.bounds, None)
+                    for i, geometry in enumerate(geometries))
+    center = []
+    neighbor = []
+    for i, geometry in enumerate(geometries):
+        prepared = prep(geometry)
+        for candidate in r.intersection(geometry.bounds):
+            if prepared.intersects(geometries[candidate]):
+                center.append(i)
+                neighbor.append(candidate)
+    return center, neighbor
+
+
+def centroid_distances(geometries, center, neighbor):
+    """Calculates the distances between the centroids of adjacent pairs
+
+    Args:
+        geometries (numpy.ndarray): shapely geometries
+        center (numpy.ndarray): indices of the center polygons
+        neighbor (numpy.ndarray): indices of the neighbor polygons
+
+    Returns:
+        distances (numpy.ndarray): float64 array aligned with the edge list"""
+
+    if SHAPELY2:
+        centroids = shapely.centroid(geometries)
+        xy = np.column_stack((shapely.get_x(centroids), shapely.get_y(centroids)))
+    else:
+        xy = np.array([geometry.centroid.coords[0] for geometry in geometries],
+                      dtype=np.float64).reshape(-1, 2)
+    delta = xy[center] - xy[neighbor]
+    return np.hypot(delta[:, 0], delta[:, 1])
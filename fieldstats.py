@@ -0,0 +1,190 @@
+"""Cached field statistics for the aChor dialog
+
+The dialog suggests a sweep interval from the value range of the selected
+field. Only this one column is read: with OGR SQL (MIN/MAX) when GDAL is
+available, otherwise directly from the fixed width records of the .dbf
+file. Other tables and field types fall back to a fiona read of the single
+field without geometries.
+
+The ranges are cached per layer, field and fingerprint (size and
+modification time) of the files, so switching back to a field or
+reopening the dialog does not read the table again. A changed file gets a
+new fingerprint and is read again."""
+
+import os
+
+import fiona
+import numpy as np
+
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
+
+try:
+    from . import adjcache
+except ImportError:
+    import adjcache
+
+_ranges = {}
+
+
+def fingerprint(path):
+    """Returns size and modification time (ns) of the files of a layer"""
+    try:
+        return tuple(map(tuple, adjcache.file_stats(path).tolist()))
+    except OSError:
+        st = os.stat(path)
+        return ((st.st_size, st.st_mtime_ns),)
+
+
+def _dbf_fields(fin):
+    """Returns name, type, offset, width and decimals of the dbf fields"""
+    fields = []
+    offset = 1  # deletion flag
+    while True:
+        descriptor = fin.read(32)
+        if len(descriptor) < 32 or descriptor[0:1] == b'\r':
+            break
+        name = descriptor[:11].split(b'\x00')[0]
+        width, decimals = descriptor[16], descriptor[17]
+        fields.append((name, descriptor[11:12], offset, width, decimals))
+        offset += width
+    return fields
+
+
+def dbf_column(dbf, field):
+    """Reads one numeric column of a dbf file
+
+    Args:
+        dbf (str): path to the .dbf file
+        field (str): name of a numeric (N or F) field
+
+    Returns:
+        A numpy array with the values of the valid records, int64 for
+        numbers without decimals and float64 otherwise. Empty cells and
+        deleted records are left out.
+
+    Raises:
+        KeyError: the field does not exist
+        ValueError: the field is not numeric or the file is not a dbf"""
+
+    with open(dbf, 'rb') as fin:
+        header = fin.read(32)
+        if len(header) < 32:
+            raise ValueError("Not a dbf file: {}".format(dbf))
+        count = int(np.frombuffer(header[4:8], dtype='<u4')[0])
+        start, reclen = np.frombuffer(header[8:12], dtype='<u2').tolist()
+        fields = _dbf_fields(fin)
+    for name, kind, offset, width, decimals in fields:
+        if name.decode('utf-8', 'replace') == field:
+            break
+    else:
+        raise KeyError(field)
+    if kind not in (b'N', b'F'):
+        raise ValueError("Field {} is not numeric".format(field))
+    if count == 0:
+        return np.zeros(0)
+
+    records = np.memmap(dbf, dtype=np.uint8, mode='r', offset=start, shape=(count, reclen))
+    valid = records[:, 0] != ord('*')
+    cells = np.ascontiguousarray(records[valid, offset:offset + width])
+    del records
+    cells = np.char.strip(cells.view('S{}'.format(width)).ravel())
+    # empty or overflowed ('***') cells are NULL
+    cells = cells[(cells != b'') & (np.char.lstrip(cells, b'*') != b'')]
+    integer = kind == b'N' and decimals == 0 and width <= 18
+    return cells.astype(np.int64 if integer else np.float64)
+
+
+def _ogr_range(path, field):
+    """Minimum and maximum of a field with OGR SQL, None if not possible"""
+    source = ogr.Open(path, 0)
+    if source is None:
+        return None
+    layer = source.GetLayer()
+    defn = layer.GetLayerDefn()
+    index = defn.GetFieldIndex(field)
+    if index < 0:
+        raise KeyError(field)
+    ftype = defn.GetFieldDefn(index).GetType()
+    if ftype not in (ogr.OFTInteger, ogr.OFTInteger64, ogr.OFTReal):
+        return None
+    sql = 'SELECT MIN("{0}"), MAX("{0}") FROM "{1}"'.format(field, layer.GetName())
+    result = source.ExecuteSQL(sql)
+    if result is None:
+        return None
+    try:
+        feature = result.GetNextFeature()
+        if feature is None or not feature.IsFieldSetAndNotNull(0):
+            return None, None
+        values = feature.GetField(0), feature.GetField(1)
+    finally:
+        source.ReleaseResultSet(result)
+    if ftype == ogr.OFTReal:
+        return tuple(float(value) for value in values)
+    return tuple(int(value) for value in values)
+
+
+def _column_range(path, field):
+    """Minimum and maximum of a field from the dbf column or with fiona"""
+    dbf = os.path.splitext(path)[0] + '.dbf'
+    if os.path.exists(dbf):
+        try:
+            values = dbf_column(dbf, field)
+            if not len(values):
+                return None, None
+            return values.min().item(), values.max().item()
+        except ValueError:
+            pass
+
+    low = high = None
+    try:
+        source = fiona.open(path, ignore_geometry=True, include_fields=[field])
+    except TypeError:  # fiona < 1.9
+        source = fiona.open(path, ignore_geometry=True)
+    with source:
+        if field not in source.schema['properties']:
+            raise KeyError(field)
+        for feature in source:
+            value = feature['properties'][field]
+            if value is None:
+                continue
+            if low is None or value < low:
+                low = value
+            if high is None or value > high:
+                high = value
+    return low, high
+
+
+def field_range(path, field):
+    """Returns the minimum and maximum of a field of a layer
+
+    Args:
+        path (str): path to the shapefile (or another OGR layer)
+        field (str): name of the field
+
+    Returns:
+        A tuple (min, max), (None, None) if the field has no values
+
+    Raises:
+        KeyError: the field does not exist"""
+
+    key = (os.path.abspath(path), field)
+    stamp = fingerprint(path)
+    cached = _ranges.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    result = None
+    if ogr is not None:
+        result = _ogr_range(path, field)
+    if result is None:
+        result = _column_range(path, field)
+    _ranges[key] = (stamp, result)
+    return result
+
+
+def clear():
+    """Forgets all cached ranges"""
+    _ranges.clear()
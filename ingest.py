@@ -0,0 +1,72 @@
+"""Streaming ingest of polygon shapefiles for aChor
+
+The features of the input are read once and multipolygons are exploded into
+their single parts on the fly. Every part gets the attributes of its source
+feature, a dense integer id (PARTID) and the FID of the source feature
+(SRCFID). The id is the rank of the part in (FID, part index) order, so it
+is stable between runs on the same dataset.
+Geometries and attributes are handed to the neighbour search directly,
+nothing is written to disk.
+
+Adjacency does not change under reprojection, so the coordinates are kept
+in the CRS of the layer unless a target CRS is requested explicitly."""
+
+import fiona
+import numpy as np
+from shapely.geometry import shape
+
+try:
+    from fiona.crs import CRS
+    from fiona.transform import transform_geom
+except ImportError:
+    CRS = None
+    transform_geom = None
+
+
+def _polygons(geometry):
+    if geometry.geom_type == 'MultiPolygon':
+        return list(geometry.geoms)
+    return [geometry]
+
+
+def explode(inputshp, crs=None):
+    """Reads a polygon shapefile and explodes it into single parts
+
+    Args:
+        inputshp (str): path to the input shapefile
+        crs: target CRS (e.g. 'EPSG:4326'), None keeps the layer CRS. The
+            geometries are only transformed if the layer CRS differs.
+
+    Returns:
+        A tuple (features, geometries), where features is a list of dicts
+        with the 'properties' of every part and geometries is an object
+        array of the shapely polygons in the same order"""
+
+    features = []
+    parts = []
+    with fiona.open(inputshp) as source:
+        transform = False
+        if crs is not None:
+            if transform_geom is None:
+                raise ValueError("Reprojection needs fiona.transform")
+            target = CRS.from_user_input(crs)
+            transform = not source.crs or source.crs != target
+        for feature in source:
+            geom = feature['geometry']
+            if geom is None:
+                continue
+            if transform:
+                geom = transform_geom(source.crs, target, geom)
+            fid = int(feature['id'])
+            properties = dict(feature['properties'])
+            for polygon in _polygons(shape(geom)):
+                record = dict(properties)
+                record['PARTID'] = len(features)
+                record['SRCFID'] = fid
+                features.append({'properties': record})
+                parts.append(polygon)
+
+    geometries = np.empty(len(parts), dtype=object)
+    for i, polygon in enumerate(parts):
+        geometries[i] = polygon
+    return features, geometries
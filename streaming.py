@@ -0,0 +1,178 @@
+"""Out-of-core neighbour search for aChor
+
+For layers whose geometries do not fit into memory the adjacency is built
+in two passes over the shapefile:
+
+1. The features are streamed once. The attributes of every single part
+   are kept, but its geometry is only used for its bounding box. The boxes
+   go to a disk-backed rtree index in a temporary directory.
+2. The parts are split into spatially ordered chunks (see
+   contiguity.split_tiles). Each chunk loads the geometries of its own
+   parts and of their possible neighbours (the index hits of the chunk's
+   bounding box) by random access. Only this window of geometries is held
+   in memory. Geometries still needed by the next chunk are kept, the rest
+   is dropped.
+
+The parts, their ids and the edge list are the same as those of
+ingest.explode and contiguity.strtree_contiguity, so the result can
+replace the in-memory search and shares its adjacency cache."""
+
+import os
+import shutil
+import tempfile
+
+import fiona
+import numpy as np
+from shapely.geometry import shape
+
+try:
+    from .contiguity import split_tiles, SHAPELY2
+except ImportError:
+    from contiguity import split_tiles, SHAPELY2
+
+if SHAPELY2:
+    import shapely
+    from shapely import STRtree
+
+
+def _polygons(geometry):
+    if geometry.geom_type == 'MultiPolygon':
+        return list(geometry.geoms)
+    return [geometry]
+
+
+def scan(inputshp, workdir):
+    """First pass: attributes and bounds of every single part
+
+    Args:
+        inputshp (str): path to the input shapefile
+        workdir (str): directory for the bounds file and the rtree index
+
+    Returns:
+        A tuple (features, fids, parts, bounds, index), where features are
+        the part dicts of ingest.explode, fids and parts the source FID and
+        part number of every part, bounds a disk-backed (n, 4) array and
+        index the rtree index of the bounds"""
+
+    from rtree import index
+
+    features = []
+    fids = []
+    parts = []
+    path = os.path.join(workdir, 'bounds.f8')
+    with open(path, 'wb') as fout:
+        with fiona.open(inputshp) as source:
+            for feature in source:
+                geom = feature['geometry']
+                if geom is None:
+                    continue
+                fid = int(feature['id'])
+                properties = dict(feature['properties'])
+                for part, polygon in enumerate(_polygons(shape(geom))):
+                    record = dict(properties)
+                    record['PARTID'] = len(features)
+                    record['SRCFID'] = fid
+                    features.append({'properties': record})
+                    fids.append(fid)
+                    parts.append(part)
+                    fout.write(np.array(polygon.bounds, dtype=np.float64).tobytes())
+    bounds = np.zeros((0, 4))
+    tree = None
+    if features:
+        bounds = np.memmap(path, dtype=np.float64, mode='r', shape=(len(features), 4))
+        tree = index.Index(os.path.join(workdir, 'bounds'),
+                           ((i, tuple(box), None) for i, box in enumerate(bounds)))
+    return features, np.array(fids, dtype=np.int64), np.array(parts, dtype=np.int64), bounds, tree
+
+
+class Window(object):
+    """Geometries of the parts needed by the current chunk
+
+    Args:
+        source: open fiona collection of the input
+        fids, parts (numpy.ndarray): source FID and part number of every part"""
+
+    def __init__(self, source, fids, parts):
+        self.source = source
+        self.fids = fids
+        self.parts = parts
+        self.geometries = {}
+
+    def load(self, needed):
+        """Loads the missing geometries of needed and drops all others
+
+        Returns:
+            An object array of the geometries in the order of needed"""
+
+        needed = needed.tolist()
+        keep = set(needed)
+        self.geometries = dict((i, geometry) for i, geometry in self.geometries.items() if i in keep)
+        polygons = {}
+        for i in needed:
+            if i not in self.geometries:
+                fid = int(self.fids[i])
+                if fid not in polygons:
+                    polygons[fid] = _polygons(shape(self.source[fid]['geometry']))
+                self.geometries[i] = polygons[fid][self.parts[i]]
+        geometries = np.empty(len(needed), dtype=object)
+        for n, i in enumerate(needed):
+            geometries[n] = self.geometries[i]
+        return geometries
+
+
+def stream_topology(inputshp, chunksize=50000, workdir=None, rook=False):
+    """Builds the adjacency of a shapefile with a bounded geometry window
+
+    Args:
+        inputshp (str): path to the input shapefile
+        chunksize (int): number of own parts per chunk
+        workdir (str): directory for the temporary files (default: system
+            temp)
+        rook (bool): only keep pairs whose boundaries share a line
+
+    Returns:
+        A tuple (features, center, neighbor, distance) like
+        class_achor.load_topology"""
+
+    if not SHAPELY2:
+        raise ValueError("The out-of-core neighbor search needs shapely 2")
+    tmp = tempfile.mkdtemp(prefix="achor_stream_", dir=workdir)
+    try:
+        features, fids, parts, bounds, tree = scan(inputshp, tmp)
+        center = []
+        neighbor = []
+        distance = []
+        chunks = int(np.ceil(len(features) / float(chunksize))) if len(features) else 0
+        with fiona.open(inputshp) as source:
+            window = Window(source, fids, parts)
+            for own in (split_tiles(np.asarray(bounds), chunks) if chunks else []):
+                box = bounds[own]
+                query = (box[:, 0].min(), box[:, 1].min(), box[:, 2].max(), box[:, 3].max())
+                candidates = np.array(sorted(tree.intersection(query)), dtype=np.int64)
+                geometries = window.load(candidates)
+                owned = np.searchsorted(candidates, own)
+                first, second = STRtree(geometries).query(geometries[owned], predicate="intersects")
+                first = owned[first]
+                keep = first != second
+                if rook:
+                    keep &= shapely.relate_pattern(geometries[first], geometries[second], '****1****')
+                first, second = first[keep], second[keep]
+                centroids = shapely.centroid(geometries)
+                xy = np.column_stack((shapely.get_x(centroids), shapely.get_y(centroids)))
+                delta = xy[first] - xy[second]
+                center.append(candidates[first])
+                neighbor.append(candidates[second])
+                distance.append(np.hypot(delta[:, 0], delta[:, 1]))
+        if tree is not None:
+            tree.close()
+        del bounds
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if not center:
+        return features, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    center = np.concatenate(center)
+    neighbor = np.concatenate(neighbor)
+    distance = np.concatenate(distance)
+    order = np.lexsort((neighbor, center))
+    return features, center[order], neighbor[order], distance[order]
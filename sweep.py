@@ -0,0 +1,429 @@
+"""Line sweep kernels for the aChor break generation
+
+Every selected center-neighbor pair spans a segment between the center and
+the neighbor value. A break is placed where most of these segments overlap.
+A segment contains a sweep position only in its interior, the end points
+do not count. A zero length segment contains its single value. This is the
+same as LineString.contains(Point) in the original discretised sweep."""
+
+import numpy as np
+
+
+def covering(lower, upper, value):
+    """Returns the mask of the segments containing value"""
+    return ((lower < value) & (upper > value)) | ((lower == value) & (upper == value))
+
+
+def exact_sweep(ids, center, neighbor, start=None, stop=None):
+    """Finds the interval of maximum segment overlap from the sorted end points
+
+    Instead of stepping through the value range with a sweep interval, the
+    segment end points are sorted once and the overlap count between two
+    consecutive end points is derived from the number of segments started
+    and ended so far. This runs in O(n log n) and cannot miss narrow
+    overlaps.
+
+    Among the plateaus with the highest count the widest one wins, ties are
+    resolved towards the higher value like in the discretised sweep. Single
+    end points only win with a higher count than every interval, which can
+    happen through zero length segments.
+
+    Args:
+        ids (array like): segment ids
+        center (array like): center values of the segments
+        neighbor (array like): neighbor values of the segments
+        start (float): lower end of the swept value range (optional)
+        stop (float): upper end of the swept value range (optional)
+
+    Returns:
+        A tuple (count, sweep, segment_ids) with the overlap count, the
+        midpoint of the best plateau and the list of segment ids covering
+        it. If no segments overlap anything (count 0), sweep is None and
+        segment_ids is empty."""
+
+    ids = np.asarray(ids)
+    center = np.asarray(center, dtype=np.float64)
+    neighbor = np.asarray(neighbor, dtype=np.float64)
+    lower = np.minimum(center, neighbor)
+    upper = np.maximum(center, neighbor)
+    if len(ids) == 0:
+        return (0, None, [])
+
+    proper = lower < upper
+    lower_sorted = np.sort(lower[proper])
+    upper_sorted = np.sort(upper[proper])
+    single_sorted = np.sort(lower[~proper])
+
+    # counts at every distinct end point p and inside the elementary interval
+    # (p, next p): #(lower <= p) - #(upper <= p) and #(lower < p) - #(upper <= p)
+    points = np.unique(np.concatenate((lower, upper)))
+    ended = np.searchsorted(upper_sorted, points, side='right')
+    inner_counts = np.searchsorted(lower_sorted, points, side='right') - ended
+    point_counts = (np.searchsorted(lower_sorted, points, side='left') - ended
+                    + np.searchsorted(single_sorted, points, side='right')
+                    - np.searchsorted(single_sorted, points, side='left'))
+
+    a = points[:-1]
+    b = points[1:]
+    lo = np.concatenate((a if start is None else np.maximum(a, start), points))
+    hi = np.concatenate((b if stop is None else np.minimum(b, stop), points))
+    counts = np.concatenate((inner_counts[:-1], point_counts))
+    # clip to the swept value range
+    inside = np.concatenate(((lo[:len(a)] < hi[:len(a)])
+                             | ((lo[:len(a)] == hi[:len(a)]) & (a < lo[:len(a)]) & (lo[:len(a)] < b)),
+                             np.ones(len(points), dtype=bool)))
+    if start is not None:
+        inside &= hi >= start
+    if stop is not None:
+        inside &= lo <= stop
+    if not inside.any():
+        return (0, None, [])
+    counts = np.where(inside, counts, -1)
+    best_cnt = counts.max()
+    if best_cnt <= 0:
+        return (0, None, [])
+
+    # widest plateau first, then the higher midpoint
+    candidates = np.flatnonzero(counts == best_cnt)
+    width = hi[candidates] - lo[candidates]
+    mid = (lo[candidates] + hi[candidates]) / 2
+    best = candidates[np.lexsort((mid, width))[-1]]
+    sweep = (lo[best] + hi[best]) / 2
+
+    return (int(best_cnt), float(sweep), ids[covering(lower, upper, sweep)].tolist())
+
+
+def sweep_positions(start, stop, step):
+    """Returns the positions of the discretised sweep
+
+    The positions are accumulated like in the original loop
+    (sweep += step while sweep <= stop), so they are bit-identical to it.
+
+    Args:
+        start (float): first sweep position
+        stop (float): last value which is still swept
+        step (float): sweep interval
+
+    Returns:
+        positions (numpy.ndarray)"""
+
+    start = float(start)
+    stop = float(stop)
+    step = float(step)
+    if step <= 0:
+        raise ValueError("Sweep interval has to be greater than 0")
+    if start > stop:
+        return np.empty(0, dtype=np.float64)
+    num = int((stop - start) / step) + 2
+    while True:
+        steps = np.full(num, step)
+        steps[0] = start
+        positions = np.add.accumulate(steps)
+        if positions[-1] > stop:
+            return positions[positions <= stop]
+        num *= 2
+
+
+def position_ranges(positions, lower, upper):
+    """Returns the range of sweep positions each segment contains
+
+    Args:
+        positions (numpy.ndarray): ascending sweep positions
+        lower (numpy.ndarray): lower end of the segments
+        upper (numpy.ndarray): upper end of the segments
+
+    Returns:
+        A tuple (first, last) of int arrays with the first and the last
+        contained position index. first > last for segments containing no
+        position."""
+
+    # lower < position < upper or the exact position of a zero length segment
+    single = lower == upper
+    first = np.where(single,
+                     np.searchsorted(positions, lower, side='left'),
+                     np.searchsorted(positions, lower, side='right'))
+    last = np.where(single,
+                    np.searchsorted(positions, upper, side='right'),
+                    np.searchsorted(positions, upper, side='left')) - 1
+    return first, last
+
+
+def stabbing_counts(num, first, last, mask=None):
+    """Counts the segments containing each sweep position by a cumulative sum
+
+    Args:
+        num (int): number of sweep positions
+        first (numpy.ndarray): first contained position of the segments
+        last (numpy.ndarray): last contained position of the segments
+        mask (numpy.ndarray): bool mask of the segments to count (optional)
+
+    Returns:
+        counts (numpy.ndarray)"""
+
+    covers = first <= last
+    if mask is not None:
+        covers &= mask
+    diff = np.zeros(num + 1, dtype=np.int64)
+    np.add.at(diff, first[covers], 1)
+    np.add.at(diff, last[covers] + 1, -1)
+    return np.cumsum(diff[:-1])
+
+
+def discrete_sweep(ids, center, neighbor, step):
+    """Vectorised discretised line sweep
+
+    Steps from the smallest to the largest center value with the sweep
+    interval and counts the segments containing every position, with the
+    same positions, rounding and segment order as the original loop over
+    LineString.contains(Point).
+
+    Args:
+        ids (array like): segment ids
+        center (array like): center values of the segments
+        neighbor (array like): neighbor values of the segments
+        step (float): sweep interval
+
+    Returns:
+        A list of tuples (count, round(sweep, 4), [segment_ids]) for every
+        sweep position, the segment ids are in the order of the input"""
+
+    ids = np.asarray(ids)
+    center = np.asarray(center, dtype=np.float64)
+    neighbor = np.asarray(neighbor, dtype=np.float64)
+    if len(ids) == 0:
+        return []
+    lower = np.minimum(center, neighbor)
+    upper = np.maximum(center, neighbor)
+    positions = sweep_positions(center.min(), center.max(), step)
+    first, last = position_ranges(positions, lower, upper)
+    counts = stabbing_counts(len(positions), first, last)
+
+    # one entry per (position, segment), grouped by position with a stable
+    # sort so that the segments keep their input order
+    lengths = np.maximum(last - first + 1, 0)
+    segment = np.repeat(np.arange(len(ids)), lengths)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    position = np.repeat(first, lengths) + offsets
+    order = np.argsort(position, kind='stable')
+    grouped = np.split(ids[segment[order]], np.cumsum(counts)[:-1])
+
+    return [(int(count), round(float(sweep), 4), group.tolist())
+            for count, sweep, group in zip(counts, positions, grouped)]
+
+
+class StabbingTree(object):
+    """Segment tree over the sweep positions with range add and max-run query
+
+    Every leaf holds the number of segments containing a sweep position.
+    Removing a segment is a range add of -1 over the positions it covers.
+    Next to the maximum count every node keeps the longest run of
+    consecutive positions at that maximum, so the plateau of a break is
+    found without looking at the single positions. Both operations take
+    O(log n).
+
+    Args:
+        counts (array like): initial stabbing count per position"""
+
+    def __init__(self, counts):
+        counts = [int(c) for c in counts]
+        self.size = len(counts)
+        if self.size == 0:
+            raise ValueError("StabbingTree needs at least one position")
+        nodes = 4 * self.size
+        self.mx = [0] * nodes       # maximum count
+        self.lazy = [0] * nodes     # pending add for the children
+        self.pre = [0] * nodes      # length of the prefix at the maximum
+        self.suf = [0] * nodes      # length of the suffix at the maximum
+        self.blen = [0] * nodes     # length of the longest run at the maximum
+        self.bstart = [0] * nodes   # start of this run, rightmost on ties
+        self._build(1, 0, self.size - 1, counts)
+
+    def _build(self, node, lo, hi, counts):
+        if lo == hi:
+            self.mx[node] = counts[lo]
+            self.pre[node] = self.suf[node] = self.blen[node] = 1
+            self.bstart[node] = lo
+            return
+        mid = (lo + hi) // 2
+        self._build(2 * node, lo, mid, counts)
+        self._build(2 * node + 1, mid + 1, hi, counts)
+        self._pull(node, lo, mid, hi)
+
+    @staticmethod
+    def _merge(left, right):
+        """Merges the summaries (mx, pre, suf, blen, bstart, lo, hi) of two
+        adjacent ranges"""
+
+        lmx, lpre, lsuf, lblen, lbstart, llo, lhi = left
+        rmx, rpre, rsuf, rblen, rbstart, rlo, rhi = right
+        mx = max(lmx, rmx)
+        best = (-1, -1)
+        if lmx == mx:
+            best = max(best, (lblen, lbstart))
+        if rmx == mx:
+            best = max(best, (rblen, rbstart))
+        if lmx == mx and rmx == mx and lsuf and rpre:
+            best = max(best, (lsuf + rpre, lhi + 1 - lsuf))
+        pre = 0
+        if lmx == mx:
+            pre = lpre
+            if lpre == lhi - llo + 1 and rmx == mx:
+                pre += rpre
+        suf = 0
+        if rmx == mx:
+            suf = rsuf
+            if rsuf == rhi - rlo + 1 and lmx == mx:
+                suf += lsuf
+        return (mx, pre, suf, best[0], best[1], llo, rhi)
+
+    def _summary(self, node, lo, hi):
+        return (self.mx[node], self.pre[node], self.suf[node],
+                self.blen[node], self.bstart[node], lo, hi)
+
+    def _pull(self, node, lo, mid, hi):
+        merged = self._merge(self._summary(2 * node, lo, mid),
+                             self._summary(2 * node + 1, mid + 1, hi))
+        (self.mx[node], self.pre[node], self.suf[node],
+         self.blen[node], self.bstart[node]) = merged[:5]
+
+    def _push(self, node):
+        if self.lazy[node]:
+            for child in (2 * node, 2 * node + 1):
+                self.mx[child] += self.lazy[node]
+                self.lazy[child] += self.lazy[node]
+            self.lazy[node] = 0
+
+    def add(self, first, last, delta):
+        """Adds delta to the counts of the positions first..last (inclusive)"""
+        first = max(int(first), 0)
+        last = min(int(last), self.size - 1)
+        if first <= last:
+            self._add(1, 0, self.size - 1, first, last, int(delta))
+
+    def _add(self, node, lo, hi, first, last, delta):
+        if first <= lo and hi <= last:
+            self.mx[node] += delta
+            self.lazy[node] += delta
+            return
+        self._push(node)
+        mid = (lo + hi) // 2
+        if first <= mid:
+            self._add(2 * node, lo, mid, first, last, delta)
+        if last > mid:
+            self._add(2 * node + 1, mid + 1, hi, first, last, delta)
+        self._pull(node, lo, mid, hi)
+
+    def query(self, first=0, last=None):
+        """Finds the longest run of positions at the maximum count
+
+        Args:
+            first (int): first position of the queried range
+            last (int): last position of the queried range (inclusive)
+
+        Returns:
+            A tuple (count, start, length) of the maximum count and the
+            longest run of consecutive positions at it. Among runs of equal
+            length the rightmost one is returned."""
+
+        if last is None:
+            last = self.size - 1
+        summary = self._query(1, 0, self.size - 1, max(int(first), 0),
+                              min(int(last), self.size - 1))
+        return (summary[0], summary[4], summary[3])
+
+    def _query(self, node, lo, hi, first, last):
+        if first <= lo and hi <= last:
+            return self._summary(node, lo, hi)
+        self._push(node)
+        mid = (lo + hi) // 2
+        if last <= mid:
+            return self._query(2 * node, lo, mid, first, last)
+        if first > mid:
+            return self._query(2 * node + 1, mid + 1, hi, first, last)
+        return self._merge(self._query(2 * node, lo, mid, first, last),
+                           self._query(2 * node + 1, mid + 1, hi, first, last))
+
+
+class DiscreteSweep(object):
+    """Repeated break extraction for the discretised line sweep
+
+    Keeps the stabbing counts of all sweep positions in a StabbingTree, so
+    that every break only removes its segments from the tree instead of
+    sweeping the whole value range again. The results are the same as
+    running the discretised sweep on the remaining segments each time: the
+    positions start at the smallest remaining center value and end at the
+    largest one. If the smallest center value changes, the grid is shifted
+    and the tree is rebuilt on the new one.
+
+    Args:
+        ids (array like): segment ids
+        center (array like): center values of the segments
+        neighbor (array like): neighbor values of the segments
+        step (float): sweep interval"""
+
+    def __init__(self, ids, center, neighbor, step):
+        self.ids = np.asarray(ids)
+        self.center = np.asarray(center, dtype=np.float64)
+        neighbor = np.asarray(neighbor, dtype=np.float64)
+        self.lower = np.minimum(self.center, neighbor)
+        self.upper = np.maximum(self.center, neighbor)
+        self.step = float(step)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.index = dict((uid, i) for i, uid in enumerate(self.ids.tolist()))
+        # centers in ascending order to track the remaining value range
+        self.by_center = np.argsort(self.center, kind='stable')
+        self.min_ptr = 0
+        self.max_ptr = len(self.ids) - 1
+        self.start = None
+        self._rebuild()
+
+    def _value_range(self):
+        while self.min_ptr <= self.max_ptr and not self.alive[self.by_center[self.min_ptr]]:
+            self.min_ptr += 1
+        while self.max_ptr >= self.min_ptr and not self.alive[self.by_center[self.max_ptr]]:
+            self.max_ptr -= 1
+        if self.min_ptr > self.max_ptr:
+            return (None, None)
+        return (self.center[self.by_center[self.min_ptr]],
+                self.center[self.by_center[self.max_ptr]])
+
+    def _rebuild(self):
+        start, stop = self._value_range()
+        self.start = start
+        self.tree = None
+        if start is None:
+            return
+        self.positions = sweep_positions(start, stop, self.step)
+        self.first, self.last = position_ranges(self.positions, self.lower, self.upper)
+        self.tree = StabbingTree(stabbing_counts(len(self.positions), self.first,
+                                                 self.last, self.alive))
+
+    def best(self):
+        """Finds the break of the remaining segments
+
+        Returns:
+            A tuple (count, sweep, segment_ids) with the maximum count, the
+            average (rounded) sweep position of the longest plateau and the
+            ids of the segments at its first position"""
+
+        start, stop = self._value_range()
+        if start is None:
+            return (0, None, [])
+        if start != self.start:
+            self._rebuild()
+        last = np.searchsorted(self.positions, stop, side='right') - 1
+        count, lb, length = self.tree.query(0, last)
+        plateau = [round(float(s), 4) for s in self.positions[lb:lb + length]]
+        sweep = sum(plateau) / len(plateau)
+        covering = self.alive & (self.first <= lb) & (self.last >= lb)
+        return (int(count), sweep, self.ids[covering].tolist())
+
+    def remove(self, segment_ids):
+        """Removes segments from the sweep"""
+        for uid in segment_ids:
+            i = self.index.get(uid)
+            if i is None or not self.alive[i]:
+                continue
+            self.alive[i] = False
+            if self.tree is not None and self.first[i] <= self.last[i]:
+                self.tree.add(self.first[i], self.last[i], -1)
@@ -0,0 +1,149 @@
+"""Background tasks of the aChor dialog
+
+Work that reads a whole layer runs in a QgsTask, so the dialog and QGIS
+stay responsive. The tasks report back with Qt signals, which are
+delivered on the GUI thread.
+
+A classification runs in a ClassifyTask. Its progress follows the phases
+of the engine (see class_achor.PHASES) and it can be canceled from the
+task manager, the engine stops at the next phase or break.
+
+The distance threshold of the hotspot method (the smallest distance band
+that gives every polygon a neighbour) is cached per layer and fingerprint
+(size and modification time) of the .shp and .dbf file."""
+
+import os
+
+import pysal
+from PyQt5.QtCore import pyqtSignal
+from qgis.core import Qgis, QgsMessageLog, QgsTask
+
+try:
+    from .fieldstats import fingerprint
+    from .class_achor import classify
+except ImportError:
+    from fieldstats import fingerprint
+    from class_achor import classify
+
+_thresholds = {}
+
+
+def cached_threshold(path):
+    """Returns the cached distance threshold of a layer or None, if it has
+    not been computed yet or the layer has changed since"""
+    cached = _thresholds.get(os.path.abspath(path))
+    if cached is not None and cached[0] == fingerprint(path):
+        return cached[1]
+    return None
+
+
+def min_threshold(path):
+    """Returns the distance threshold of a polygon shapefile
+
+    The threshold is computed by PySAL from the centroids of the polygons.
+    Thresholds below 1 are taken as decimal degrees and converted to
+    meters. The result is cached.
+
+    Args:
+        path (str): path to the shapefile
+
+    Returns:
+        The threshold (float), rounded to meters"""
+
+    thresh = cached_threshold(path)
+    if thresh is not None:
+        return thresh
+    stamp = fingerprint(path)
+    thresh = pysal.min_threshold_dist_from_shapefile(path)
+    if float(thresh) < 1: #convert decimal degree to meters
+        thresh = round(thresh * 84244.43662,0)
+    else:
+        thresh = round(thresh,0)
+    _thresholds[os.path.abspath(path)] = (stamp, thresh)
+    return thresh
+
+
+class ThresholdTask(QgsTask):
+    """Computes the distance threshold of a layer in the background
+
+    Args:
+        path (str): path to the shapefile
+
+    The signal computed(path, threshold) is emitted when the threshold is
+    known."""
+
+    computed = pyqtSignal(str, float)
+
+    def __init__(self, path):
+        QgsTask.__init__(self, "aChor: distance threshold of {}".format(os.path.basename(path)),
+                         QgsTask.CanCancel)
+        self.path = path
+        self.thresh = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.thresh = min_threshold(self.path)
+        except Exception as e:
+            self.error = e
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        if result:
+            self.computed.emit(self.path, float(self.thresh))
+        elif self.error is not None:
+            QgsMessageLog.logMessage("Distance threshold of {} failed: {}".format(self.path, self.error),
+                                     "aChor", Qgis.Warning)
+
+
+class Canceled(Exception):
+    """Raised in the progress callback to stop a canceled classification"""
+    pass
+
+
+class ClassifyTask(QgsTask):
+    """Runs an aChor classification in the background
+
+    Args:
+        description (str): name of the task in the task manager
+        layer_path, field, classes, sweep, method, calfd, **kwargs: see
+            class_achor.classify
+
+    One of the signals is emitted when the task is over: classified(brks)
+    with the breaks, failed(message) with the error or canceled()."""
+
+    classified = pyqtSignal(list)
+    failed = pyqtSignal(str)
+    canceled = pyqtSignal()
+
+    def __init__(self, description, layer_path, field, classes, sweep, method=1, calfd='', **kwargs):
+        QgsTask.__init__(self, description, QgsTask.CanCancel)
+        self.args = (layer_path, field, classes, sweep, method, calfd)
+        self.kwargs = kwargs
+        self.brks = None
+        self.error = None
+
+    def report(self, percent, phase):
+        """Progress callback of the engine"""
+        self.setProgress(percent)
+        if self.isCanceled():
+            raise Canceled()
+
+    def run(self):
+        try:
+            self.brks = classify(*self.args, progress=self.report, **self.kwargs)
+        except Canceled:
+            return False
+        except Exception as e:
+            self.error = e
+            return False
+        return True
+
+    def finished(self, result):
+        if result:
+            self.classified.emit(list(self.brks))
+        elif self.isCanceled():
+            self.canceled.emit()
+        else:
+            self.failed.emit(str(self.error))
@@ -0,0 +1,59 @@
+"""Regression check for fields with many tied values
+
+A grid with an integer field that only has a few distinct values has
+plateaus instead of strict local extremes, on some fields there is no
+extreme at all and nothing to sweep. The classification must still
+return the desired number of breaks."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import fiona
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from class_achor import classify, BACKENDS
+
+
+def write_grid(path, size=12):
+    """Writes a size x size grid, 'cat' has the values 0 to 2 and 'flat'
+    only 0 (left half) and 1 (right half)"""
+    schema = {'geometry': 'Polygon', 'properties': {'cat': 'int:4', 'flat': 'int:4'}}
+    with fiona.open(path, 'w', 'ESRI Shapefile', schema) as dst:
+        for i in range(size):
+            for j in range(size):
+                ring = [(i, j), (i+1, j), (i+1, j+1), (i, j+1), (i, j)]
+                dst.write({'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                           'properties': {'cat': (i*7 + j*3) % 2 + i*2 // size, 'flat': i*2 // size}})
+
+
+class TiedValuesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="achor_ties_")
+        cls.shp = os.path.join(cls.workdir, "ties.shp")
+        write_grid(cls.shp)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_breaks(self):
+        for field in ('cat', 'flat'):
+            for method in (1, 2, 3, 5, 71, 72, 73):
+                for backend in BACKENDS:
+                    brks = classify(self.shp, field, 5, 1.0, method, backend=backend, cache=False)
+                    self.assertEqual(len(brks), 4, (field, method, backend))
+
+    def test_backends_agree(self):
+        for method in (1, 2, 3):
+            results = [classify(self.shp, 'cat', 5, 1.0, method, backend=backend, cache=False)
+                       for backend in BACKENDS]
+            self.assertEqual(results[0], results[1], method)
+
+
+if __name__ == '__main__':
+    unittest.main()
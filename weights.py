@@ -0,0 +1,203 @@
+"""Precomputed spatial weights for aChor
+
+Layers whose contiguity is already known (PySAL GAL/GWT files or a CSR
+adjacency saved with NumPy/SciPy) can be classified without geometries.
+The neighbours come from the weights file and the values from an
+attribute table (CSV or DBF). No polygon is read, exploded or intersected.
+
+The ids in a weights file refer to the records of the table. They are the
+values of an id field when one is given or named in the GAL/GWT header
+and exists in the table. Otherwise they are 0-based row indices. A CSR
+file always refers to rows. There is no geometry, so the distance of every
+pair is 0."""
+
+import csv
+import os
+
+import fiona
+import numpy as np
+
+
+def _number(text):
+    """Converts a table or weights token to int or float where possible"""
+    text = text.strip()
+    if text == '':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _key(value):
+    """Comparable id of a table value or a weights token (5, 5.0 and '5'
+    are the same id)"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _cell(value, raw):
+    """Value of a CSV cell, kept as text for raw columns"""
+    if value is None:
+        return None
+    if raw:
+        return value.strip() or None
+    return _number(value)
+
+
+def read_table(path, raw=()):
+    """Reads the records of an attribute table
+
+    Args:
+        path (str): CSV file or DBF file (the table of a shapefile)
+        raw (list): CSV columns that are kept as text, e.g. ids with
+            leading zeros like '01001' (default: none)
+
+    Returns:
+        records (list): one dict of properties per row, empty CSV cells are
+        None and numeric CSV cells of the other columns are converted to
+        int or float"""
+
+    if path.lower().endswith('.csv'):
+        with open(path) as fin:
+            return [dict((name, _cell(value, name in raw)) for name, value in row.items())
+                    for row in csv.DictReader(fin)]
+    with fiona.open(path, ignore_geometry=True) as source:
+        return [dict(feature['properties']) for feature in source]
+
+
+def _header(tokens):
+    """Returns the id variable of a GAL/GWT header line or None"""
+    if len(tokens) >= 4:
+        return tokens[-1]
+    return None
+
+
+def read_gal(path):
+    """Reads a PySAL GAL file
+
+    Returns:
+        A tuple (center, neighbor, idvar) with the ids of the pairs as
+        tokens and the id variable of the header (None if not given)"""
+
+    with open(path) as fin:
+        idvar = _header(fin.readline().split())
+        tokens = fin.read().split()
+    center = []
+    neighbor = []
+    i = 0
+    while i < len(tokens):
+        polygon, count = tokens[i], int(tokens[i+1])
+        others = tokens[i+2:i+2+count]
+        if len(others) < count:
+            raise ValueError("Truncated GAL file: {}".format(path))
+        center.extend([polygon] * count)
+        neighbor.extend(others)
+        i += 2 + count
+    return center, neighbor, idvar
+
+
+def read_gwt(path):
+    """Reads a PySAL GWT file, the weights column is ignored
+
+    Returns:
+        A tuple (center, neighbor, idvar), see read_gal"""
+
+    center = []
+    neighbor = []
+    with open(path) as fin:
+        idvar = _header(fin.readline().split())
+        for line in fin:
+            tokens = line.split()
+            if len(tokens) >= 2:
+                center.append(tokens[0])
+                neighbor.append(tokens[1])
+    return center, neighbor, idvar
+
+
+def read_csr(path):
+    """Reads a CSR adjacency matrix from a .npz file
+
+    The file needs the arrays indptr and indices, as written by
+    scipy.sparse.save_npz or numpy.savez.
+
+    Returns:
+        A tuple (center, neighbor) of row indices"""
+
+    with np.load(path) as data:
+        indptr = np.asarray(data['indptr'], dtype=np.int64)
+        indices = np.asarray(data['indices'], dtype=np.int64)
+    center = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return center, indices
+
+
+def load_weights(weights, table, idfield=None):
+    """Returns the features of an attribute table and the adjacency of a
+    weights file, in the format of load_topology
+
+    Args:
+        weights (str): GAL, GWT or CSR (.npz) file
+        table (str): CSV or DBF file with the attributes
+        idfield (str): field of the table with the ids used in the weights
+            file (default: the id variable of the header or the row index)
+
+    Returns:
+        A tuple (features, center, neighbor, distance), where features
+        is a list of feature dicts with 'properties' and center, neighbor
+        and distance are the edge list arrays sorted by center"""
+
+    print("Using weights: " + weights)
+    extension = os.path.splitext(weights)[1].lower()
+    if extension == '.npz':
+        center, neighbor = read_csr(weights)
+        records = read_table(table)
+    else:
+        if extension == '.gal':
+            center, neighbor, idvar = read_gal(weights)
+        elif extension == '.gwt':
+            center, neighbor, idvar = read_gwt(weights)
+        else:
+            raise ValueError("Unknown weights format: {}".format(weights))
+        # the id column of a CSV table is read as text
+        records = read_table(table, raw=[name for name in (idfield, idvar) if name])
+        if idfield is None and records and idvar in records[0]:
+            idfield = idvar
+        if idfield is not None:
+            # string ids (e.g. GEOID '01001') are compared as they are, only
+            # ids of a numeric column are compared as numbers
+            ids = [record[idfield] for record in records]
+            if all(isinstance(value, (int, float)) for value in ids if value is not None):
+                key = lambda token: _key(_number(token))
+            else:
+                key = lambda token: token.strip()
+            rows = {}
+            for i, value in enumerate(ids):
+                rows.setdefault(_key(value), i)
+            try:
+                center = [rows[key(token)] for token in center]
+                neighbor = [rows[key(token)] for token in neighbor]
+            except KeyError as e:
+                raise ValueError("Unknown id {} in {}".format(e.args[0], weights))
+        else:
+            center = [int(token) for token in center]
+            neighbor = [int(token) for token in neighbor]
+    center = np.asarray(center, dtype=np.int64)
+    neighbor = np.asarray(neighbor, dtype=np.int64)
+    if len(center) and (min(center.min(), neighbor.min()) < 0 or max(center.max(), neighbor.max()) >= len(records)):
+        raise ValueError("Weights {} refer to rows outside of {}".format(weights, table))
+
+    # no self pairs and every pair once, sorted by center
+    keep = center != neighbor
+    edges = np.unique(np.stack([center[keep], neighbor[keep]], axis=1), axis=0) if keep.any() \
+        else np.zeros((0, 2), dtype=np.int64)
+
+    features = []
+    for i, record in enumerate(records):
+        properties = dict(record)
+        properties['PARTID'] = i
+        properties['SRCFID'] = i
+        features.append({'properties': properties})
+    return features, edges[:, 0], edges[:, 1], np.zeros(len(edges))